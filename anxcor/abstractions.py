@@ -1,4 +1,5 @@
 import  anxcor.utils as utils
+import anxcor.filters as filt_ops
 from obspy.core import UTCDateTime
 import xarray as xr
 try:
@@ -9,6 +10,12 @@ except:
 import pandas as pd
 import numpy as np
 import json
+import os
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 TAPER_DEFAULT   =0.05
 RESAMPLE_DEFAULT=10.0
@@ -34,14 +41,24 @@ WHITEN_WINDOW_RATIO=0.01
 FILTER_ORDER_WHITEN=3
 WHITEN_TYPE='reduce_metric'
 sep_char = OPERATIONS_SEPARATION_CHARACTER
+
+## intermediate storage formats
+NETCDF_FORMAT  = 'netcdf'
+CHUNKED_FORMAT = 'chunked'
+IO_FORMATS     = [NETCDF_FORMAT, CHUNKED_FORMAT]
+CHUNKED_INDEX  = 'index.jsonl'
+CHUNKED_EXTENSION = '.bin'
+_chunked_indexes   = {}
+_chunked_index_lock= threading.Lock()
+
 def write(xarray, path, extension):
     array_path      = '{}{}{}{}'.format(path, utils.sep, extension, '.nc')
     data = xarray.copy()
     data.attrs = {}
     data.to_netcdf(array_path)
     if 'df' in xarray.attrs.keys():
-        attributes_path = '{}{}{}{}'.format(path, utils.sep, extension, '.metadata.csv')
-        xarray.attrs['df'].to_csv(attributes_path,index_label='index')
+        attributes_path = '{}{}{}{}'.format(path, utils.sep, extension, '.metadata.npz')
+        utils.write_metadata_table(xarray.attrs['df'], attributes_path)
     else:
         attributes_path = '{}{}{}{}'.format(path, utils.sep, extension, '.metadata.json')
         with open(attributes_path, 'w') as p_file:
@@ -57,11 +74,15 @@ def read(path, extension):
         return None
 
     try:
-        try:
-            attributes_path = '{}{}{}{}'.format(path, utils.sep, extension, '.metadata.csv')
-            attrs = {}
-            attrs['df']=pd.read_csv(attributes_path,index_col='index')
-        except Exception:
+        attrs = {}
+        table_path = '{}{}{}{}'.format(path, utils.sep, extension, '.metadata.npz')
+        csv_path   = '{}{}{}{}'.format(path, utils.sep, extension, '.metadata.csv')
+        if utils.file_exists(table_path):
+            attrs['df']=utils.read_metadata_table(table_path)
+        elif utils.file_exists(csv_path):
+            # windows saved before the binary metadata table
+            attrs['df']=pd.read_csv(csv_path,index_col='index',float_precision='round_trip')
+        else:
             attributes_path = '{}{}{}{}'.format(path, utils.sep, extension, '.metadata.json')
             with open(attributes_path, 'r') as p_file:
                 attrs = json.load(p_file)
@@ -72,11 +93,91 @@ def read(path, extension):
     return xarray
 
 
+def write_chunked(xarray, path, window, station):
+    """
+    appends a station window to the station's binary file under path, and records its offset,
+    coordinates and attributes as one line of the consolidated index of path
+    """
+    data   = np.ascontiguousarray(xarray.data)
+    record = {'window': window, 'station': station, 'file': station + CHUNKED_EXTENSION,
+              'dtype': data.dtype.str, 'shape': list(data.shape), 'dims': list(xarray.dims),
+              'name': xarray.name, 'attrs': xarray.attrs,
+              'coords': {dim: xarray.coords[dim].values.tolist() for dim in xarray.dims if dim != 'time'}}
+    record['time'] = utils.encode_time_coordinate(xarray.coords['time'].values)
+
+    index_path = '{}{}{}'.format(path, utils.sep, CHUNKED_INDEX)
+    data_path  = '{}{}{}'.format(path, utils.sep, record['file'])
+    with open(index_path, 'a') as index_file:
+        # writers from other threads and processes append one window at a time
+        if fcntl is not None:
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+        try:
+            with open(data_path, 'ab') as data_file:
+                record['offset'] = data_file.seek(0, os.SEEK_END)
+                data.tofile(data_file)
+            index_file.write(json.dumps(record, sort_keys=True) + '\n')
+            index_file.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+
+
+def read_chunked(path, window, station):
+    """
+    returns the latest saved station window as a read-only memory mapped xarray, or None
+    """
+    record = _get_chunked_index(path).get((window, station), None)
+    if record is None:
+        print('Data File:\n {}\n not found. Ignoring window'.format(
+            '{}{}{} at {}'.format(path, utils.sep, station + CHUNKED_EXTENSION, window)))
+        return None
+    data_path = '{}{}{}'.format(path, utils.sep, record['file'])
+    data = np.memmap(data_path, dtype=np.dtype(record['dtype']), mode='r',
+                     offset=record['offset'], shape=tuple(record['shape']))
+    times  = utils.decode_time_coordinate(record['time'])
+    coords = [(dim, times if dim == 'time' else record['coords'][dim]) for dim in record['dims']]
+    return xr.DataArray(data, coords=coords, attrs=record['attrs'], name=record['name'])
+
+
+def _get_chunked_index(path):
+    # parses only the lines appended since the index was last read, unless the index was replaced
+    index_path = '{}{}{}'.format(path, utils.sep, CHUNKED_INDEX)
+    if not os.path.exists(index_path):
+        return {}
+    with _chunked_index_lock:
+        with open(index_path, 'r') as index_file:
+            first_line = index_file.readline()
+            identity   = (os.fstat(index_file.fileno()).st_ino, first_line)
+            cached_identity, size, records = _chunked_indexes.get(index_path, (None, 0, {}))
+            current_size = os.fstat(index_file.fileno()).st_size
+            if cached_identity != identity or current_size < size:
+                size, records = 0, {}
+            if current_size > size:
+                index_file.seek(size)
+                lines = index_file.read(current_size - size).splitlines(True)
+                for line in lines:
+                    if not line.endswith('\n'):
+                        break
+                    record = json.loads(line)
+                    records[(record['window'], record['station'])] = record
+                    size  += len(line.encode())
+            _chunked_indexes[index_path] = (identity, size, records)
+        return records
+
+
 class _IO:
 
     def __init__(self, dir):
         self._file      = dir
         self._isenabled = False
+        self._format    = NETCDF_FORMAT
+
+    def _set_format(self, format):
+        if format not in IO_FORMATS:
+            print('{} is not a valid storage format. must be one of {}. Using {}'.format(format, IO_FORMATS,
+                                                                                     NETCDF_FORMAT))
+            format = NETCDF_FORMAT
+        self._format = format
 
     def enable(self):
         self._isenabled=True
@@ -120,8 +221,9 @@ class _XArrayWrite(_IO):
     def __init__(self, directory=None):
         super().__init__(dir)
 
-    def set_folder(self, file):
+    def set_folder(self, file, format=NETCDF_FORMAT):
         self.enable()
+        self._set_format(format)
         if not utils.folder_exists(file):
             utils.make_dir(file)
         self._file = file
@@ -133,6 +235,11 @@ class _XArrayWrite(_IO):
 
     def __call__(self, xarray, process, folder, file, dask_client=None, **kwargs):
         if self._file is not None and xarray is not None:
+            if self._format == CHUNKED_FORMAT:
+                process_folder = '{}{}{}'.format(self._file, utils.sep, process)
+                self._chkmkdir(process_folder)
+                write_chunked(xarray, process_folder, folder, file)
+                return None
             folder    = '{}{}{}{}{}'.format(self._file, utils.sep, process, utils.sep, folder)
             self._chkmkdir(folder)
             write(xarray, folder, file)
@@ -145,13 +252,16 @@ class _XArrayRead(_IO):
         super().__init__(directory)
         self._file = directory
 
-    def set_folder(self, directory):
+    def set_folder(self, directory, format=NETCDF_FORMAT):
         self.enable()
+        self._set_format(format)
         if not utils.folder_exists(directory):
             utils.make_dir(directory)
         self._file = directory
 
     def __call__(self, process=None, folder=None, file=None, **kwargs):
+        if self._format == CHUNKED_FORMAT:
+            return read_chunked('{}{}{}'.format(self._file, utils.sep, process), folder, file)
         folder ='{}{}{}{}{}'.format(self._file,utils.sep,process,utils.sep,folder)
         return read(folder, file)
 
@@ -166,6 +276,7 @@ class AnxcorTask:
         self._enabled = True
         self._fire_and_forget = None
         self._process_number = 0
+        self._pending_writes = []
 
     def increment_process_number(self):
         self._process_number+=1
@@ -173,11 +284,11 @@ class AnxcorTask:
     def disable(self):
         self._enabled=False
 
-    def set_io_task(self, folder, action, **kwargs):
+    def set_io_task(self, folder, action, format=NETCDF_FORMAT, **kwargs):
         if action=='save':
-            self.write_execute.set_folder(folder)
+            self.write_execute.set_folder(folder, format=format)
         else:
-            self.read.set_folder(folder)
+            self.read.set_folder(folder, format=format)
 
 
     def set_kwargs(self, kwarg):
@@ -210,6 +321,14 @@ class AnxcorTask:
             result = delayed(self._prepare_launch_process)(*args, dask_key_name=key, **kwargs)
         return result
 
+    def _launch_window_task(self, method, *args, dask_client=None, key=None, **kwargs):
+        if dask_client is None:
+            return method(*args, **kwargs)
+        return delayed(method)(*args, dask_key_name=key, **kwargs)
+
+    def has_io_enabled(self):
+        return self.read.is_enabled() or self.write_execute.is_enabled()
+
     def _prepare_launch_process(self, *args, **kwargs):
         persisted_name, persisted_metadata  = self._persist_name_and_metadata(*args,**kwargs)
         result = self._launch_process(*args,**kwargs)
@@ -275,7 +394,15 @@ class AnxcorTask:
             self.write_execute(result, process, folder, file)
         else:
             end = delayed(self.write_execute)( result, process, folder, file,dask_key_name='writing: ' + key)
-            end.compute()
+            self._pending_writes.append(end)
+
+    def pop_pending_writes(self):
+        """
+        returns the delayed writes queued under dask since the last call, and clears them
+        """
+        pending = self._pending_writes
+        self._pending_writes = []
+        return pending
 
     def __metadata_to_persist(self,*param,**kwargs):
         if param is None or (len(param)==1 and param[0] is None):
@@ -295,6 +422,9 @@ class AnxcorTask:
             attrs = param[0].attrs.copy()
         else:
             attrs = {**param[0].attrs.copy(), **param[1].attrs.copy()}
+        return self._extend_metadata(attrs)
+
+    def _extend_metadata(self, attrs):
         added_kv_metadata = self._add_metadata_key()
         add_operation     = self._add_operation_string()
         if added_kv_metadata is not None:
@@ -358,6 +488,9 @@ class XArrayProcessor(AnxcorTask):
         super().__init__(*args,**kwargs)
 
     def _additional_read_processing(self, result):
+        if isinstance(result, xr.DataArray):
+            # chunked reads are already memory mapped station windows
+            return result
         if result is not None:
             name   = list(result.data_vars)[0]
             xarray       = result[name].copy()
@@ -372,6 +505,32 @@ class XArrayProcessor(AnxcorTask):
     def _window_key_convert(self,starttime=0):
         return UTCDateTime(int(starttime*100)/100).isoformat()
 
+    def execute_fused(self, data, window):
+        """
+        numpy counterpart of execute, used when Anxcor fuses consecutive processors of a station window.
+
+        Parameters
+        ----------
+        data: np.ndarray
+            (channel, station_id, time) block owned by the fused chain. It may be modified in place
+        window: dict
+            'delta' in seconds, 'start_ns' and 'delta_ns' of the time axis, and the 'channels' names.
+            processors which change the time axis update these entries
+
+        Returns
+        -------
+            the processed (channel, station_id, time) block
+        """
+        raise NotImplementedError('Method: \'execute_fused()\' is not implemented for {}'.format(self.get_name()))
+
+    def _can_fuse(self):
+        return self._has_fused_kernel() and self._parent_can_process() and not self.has_io_enabled()
+
+    def _has_fused_kernel(self):
+        # only the built-in processors have kernels, and a subclass may override any of their
+        # hooks, so built-ins return True only when type(self) is exactly their class
+        return False
+
 
 class AnxcorDataTask(AnxcorTask):
 
@@ -484,7 +643,58 @@ class XArrayRolling(XArrayProcessor):
         return normed_array
 
     def _get_rolling_samples(self,processed_xarray : xr.DataArray, xarray: xr.DataArray)-> int:
-        return int(self._kwargs['window'] / xarray.attrs['delta'])
+        return self._rolling_sample_count(xarray.attrs['delta'], xarray.data.shape[-1])
+
+    def _rolling_sample_count(self, delta, npts):
+        return int(self._kwargs['window'] / delta)
+
+    def execute_fused(self, data, window):
+        processed   = self._preprocess_fused(data, window)
+        pre_rolling = self._pre_rolling_process_fused(processed, data, window)
+        rolling_samples = self._rolling_sample_count(window['delta'], data.shape[-1])
+        if 0 < rolling_samples <= pre_rolling.shape[-1]:
+            rolled = filt_ops.centered_rolling_mean(pre_rolling, rolling_samples, axis=-1)
+        else:
+            rolled = xr.DataArray(pre_rolling).rolling(dim_2=rolling_samples, center=True,
+                                                       min_periods=rolling_samples).mean().data
+        post_rolling = self._post_rolling_process_fused(rolled, data, window)
+        normalized   = processed / self._reduce_by_channel_fused(post_rolling, window)
+        return self._postprocess_fused(normalized, data, window)
+
+    def _has_rolling_mean_kernel(self):
+        # the numpy kernel only covers centered running means
+        return self._kwargs['rolling_metric'] == 'mean' and self._kwargs['center']
+
+    def _preprocess_fused(self, data, window):
+        return data
+
+    def _pre_rolling_process_fused(self, processed, data, window):
+        return processed
+
+    def _post_rolling_process_fused(self, rolled, data, window):
+        return rolled
+
+    def _postprocess_fused(self, normalized, data, window):
+        return normalized
+
+    def _reduce_by_channel_fused(self, rolled, window):
+        if self._kwargs['approach'] != 'src':
+            return rolled
+        reduction_procedure = self._kwargs['reduce_metric']
+        if reduction_procedure == 'mean' or reduction_procedure is None:
+            return np.mean(rolled, axis=0, keepdims=True)
+        elif reduction_procedure == 'median':
+            return np.median(rolled, axis=0, keepdims=True)
+        elif reduction_procedure == 'min':
+            return np.min(rolled, axis=0, keepdims=True)
+        elif reduction_procedure == 'max':
+            return np.max(rolled, axis=0, keepdims=True)
+        elif 'z' in reduction_procedure.lower() or 'n' in reduction_procedure.lower() \
+                or 'e' in reduction_procedure.lower():
+            for index, coordinate in enumerate(window['channels']):
+                if reduction_procedure in coordinate.lower():
+                    return rolled[index:index + 1]
+        return rolled
 
     def _apply_rolling_method(self, processed_xarray, original_xarray):
         rolling_samples = self._get_rolling_samples(processed_xarray, original_xarray)
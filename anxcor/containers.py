@@ -3,9 +3,13 @@ import  anxcor.abstractions as ab
 import  anxcor.utils as os_utils
 from  obspy.core import read, Stream, UTCDateTime
 import xarray as xr
-import pandas as pd
 FLOAT_PRECISION = 1e-9
+ALIGNMENT_TOLERANCE = 1e-6 # fraction of a sample
 import numpy as np
+import json
+import os
+import queue
+import threading
 #import sparse
 
 def execute_if_ok_else_pass_through(method, one, two):
@@ -84,6 +88,36 @@ class AnxcorDatabase:
         """
         raise NotImplementedError('Method: \'get_waveforms()\' is not implemented!')
 
+    def get_waveforms_bulk(self, requests: List[dict], **kwargs) -> Stream:
+        """
+        optional. returns one obspy Stream holding the waveforms of many station windows at once. Databases
+        which can serve many stations faster in one query should implement it; otherwise Anxcor falls back
+        to get_waveforms()
+
+        Parameters
+        ----------
+        requests : List[dict],
+            a list of get_waveforms() keyword arguments, each with network, station, starttime and endtime
+
+        Returns
+        -------
+        Stream
+            an obspy stream with the traces of every request. Traces may extend beyond a requested window
+        """
+        raise NotImplementedError('Method: \'get_waveforms_bulk()\' is not implemented')
+
+    def get_station_coordinates(self) -> dict:
+        """
+        optional. returns the coordinates of the stations in the dataset. Only needed to restrict station
+        pairs by inter-station distance
+
+        Returns
+        -------
+        dict
+            a dictionary mapping 'network_code.station_code' to a (latitude, longitude) tuple in degrees
+        """
+        raise NotImplementedError('Method: \'get_station_coordinates()\' is not implemented')
+
 
 class DataLoader(ab.AnxcorDataTask):
 
@@ -93,6 +127,8 @@ class DataLoader(ab.AnxcorDataTask):
         self._kwargs['interp_method']=interp_method
         self._seconds_buffer = 1.0
         self._datasets = {}
+        self._prefetched = {}
+        self._no_bulk    = set()
 
     def add_dataset(self, dataset: AnxcorDatabase, name: str, **kwargs):
         self._datasets[name]=dataset
@@ -116,6 +152,26 @@ class DataLoader(ab.AnxcorDataTask):
 
         return station_list
 
+    def get_station_coordinates(self) -> dict:
+        """
+
+        Returns
+        -------
+        coordinates
+            a dictionary of (latitude, longitude) tuples for every station whose database provides coordinates
+
+        """
+        coordinates = {}
+        for key, value in self._datasets.items():
+            try:
+                dataset_coordinates = value.get_station_coordinates()
+            except NotImplementedError:
+                continue
+            for station, coordinate in dataset_coordinates.items():
+                if station not in coordinates:
+                    coordinates[station] = coordinate
+        return coordinates
+
     def has_data(self):
         return len(self._datasets.keys())>0
 
@@ -137,35 +193,89 @@ class DataLoader(ab.AnxcorDataTask):
         gather = '{}:{}@{}'.format('gather',data_key,extension)
         return gather
 
-    def execute(self, *args, station=0, starttime=0, **kwargs):
+    def _request_kwargs(self, station, starttime):
         network, station = station.split('.')
-
-        kwarg_execute    = {
+        return {
             'network' : network,
             'station' : station,
             'starttime':starttime - self._seconds_buffer,
             'endtime':  starttime + self._seconds_buffer + self._kwargs['window_length']
             }
 
+    def prefetch(self, stations, starttimes):
+        """
+        fetches every station window with one get_waveforms_bulk() call per database, holding the streams
+        until execute() asks for them. Databases without a bulk method are left to the per station path
+        """
+        requests = [self._request_kwargs(station, starttime) for starttime in starttimes for station in stations]
+        for name, dataset in self._datasets.items():
+            if name in self._no_bulk:
+                continue
+            try:
+                stream = dataset.get_waveforms_bulk(requests)
+            except NotImplementedError:
+                self._no_bulk.add(name)
+                continue
+            for starttime in starttimes:
+                for station in stations:
+                    self._prefetched[(name, station, starttime)] = self._select_request(stream, station, starttime)
+
+    def _select_request(self, stream, station, starttime):
+        if stream is None:
+            return None
+        request  = self._request_kwargs(station, starttime)
+        selected = stream.select(network=request['network'], station=request['station'])
+        return selected.slice(starttime=UTCDateTime(request['starttime']), endtime=UTCDateTime(request['endtime']))
+
+    def discard_prefetched(self, starttime):
+        for key in [key for key in list(self._prefetched.keys()) if key[2]==starttime]:
+            self._prefetched.pop(key, None)
+
+    def _get_waveforms(self, name, dataset, station, starttime):
+        key = (name, station, starttime)
+        if key in self._prefetched:
+            return self._prefetched.pop(key)
+        return dataset.get_waveforms(**self._request_kwargs(station, starttime))
+
+    def execute(self, *args, station=0, starttime=0, **kwargs):
         traces = []
         for name, dataset in self._datasets.items():
-            stream = dataset.get_waveforms(**kwarg_execute)
+            stream = self._get_waveforms(name, dataset, station, starttime)
+            if stream is None:
+                continue
+            aligned = Stream()
             for trace in stream:
                 rate = trace.stats.sampling_rate
                 # requires 2 points so as to match obspy's trim
                 npts = int(rate*self._kwargs['window_length'])+1
                 end_time = UTCDateTime(starttime+npts*trace.stats.delta)
                 trace.stats.name=name
-                if self._not_none_condition(trace,starttime,end_time):
-                    trace.interpolate(rate,starttime=starttime,npts=npts,method=self._kwargs['interp_method'])
-                else:
-                    stream.remove(trace)
-            traces = self._combine(traces, stream, name)
+                if self._covers_window(trace,starttime,end_time) and self._align_trace(trace,starttime,npts):
+                    aligned.append(trace)
+            traces = self._combine(traces, aligned, name)
         return Stream(traces=traces)
 
-    def _not_none_condition(self,trace,starttime,end_time):
-        return starttime >= trace.stats.starttime.timestamp and \
-        end_time < trace.stats.endtime and not np.isnan(trace.data).any()
+    def _covers_window(self,trace,starttime,end_time):
+        return starttime >= trace.stats.starttime.timestamp and end_time < trace.stats.endtime
+
+    def _align_trace(self, trace, starttime, npts):
+        """
+        snaps the trace onto the window grid. Traces sampled on the grid are sliced without a copy, and only
+        fractional offsets are interpolated. Returns False if the window holds NaNs
+        """
+        offset = (starttime - trace.stats.starttime.timestamp) / trace.stats.delta
+        first  = int(round(offset))
+        if abs(offset - first) < ALIGNMENT_TOLERANCE and first + npts <= len(trace.data):
+            window = trace.data[first:first + npts]
+            if np.isnan(window).any():
+                return False
+            trace.data = window
+            trace.stats.starttime = UTCDateTime(starttime)
+            return True
+        if np.isnan(trace.data).any():
+            return False
+        trace.interpolate(trace.stats.sampling_rate,starttime=starttime,npts=npts,method=self._kwargs['interp_method'])
+        return True
 
     def _io_result(self, result, source, format='mseed', **kwargs):
         type_dict = {}
@@ -222,10 +332,63 @@ class DataLoader(ab.AnxcorDataTask):
 
 
 class XArrayCombine(ab.AnxcorDataTask):
+    """
+    combines the pair correlations of a window into one dataset
+
+    called with two correlations it merges them, so Anxcor can reduce a window pairwise.
+    combine_all builds the dataset from every correlation of the window in a single pass
+    """
 
     def __init__(self,**kwargs):
         super().__init__(**kwargs)
 
+    def combine_all(self, correlations, **kwargs):
+        """
+        combines every correlation of a window at once
+
+        Parameters
+        ----------
+        correlations: list
+            the pair correlations (xr.DataArray or xr.Dataset, or None) of one window
+
+        Returns
+        -------
+        xr.Dataset
+            the dataset produced by reducing the correlations pairwise, built from one
+            preallocated array per variable. Metadata tables are concatenated once
+        """
+        correlations = [correlation for correlation in correlations if correlation is not None]
+        if not correlations:
+            return None
+        arrays = {}
+        for correlation in correlations:
+            if isinstance(correlation, xr.DataArray):
+                arrays.setdefault(correlation.name, []).append(correlation)
+            else:
+                for name in correlation.data_vars:
+                    arrays.setdefault(name, []).append(correlation[name])
+        data_vars = {name: self._preallocated_concat(name, variables) for name, variables in arrays.items()}
+        result    = xr.Dataset(data_vars=data_vars)
+        result.attrs = {'df': os_utils.concat_metadata([correlation.attrs['df'] for correlation in correlations])}
+        return result
+
+    def _preallocated_concat(self, name, variables):
+        dims   = variables[0].dims
+        coords = {}
+        for dim in dims:
+            index = variables[0].indexes[dim]
+            for variable in variables[1:]:
+                if not variable.indexes[dim].equals(index):
+                    index = index.union(variable.indexes[dim])
+            coords[dim] = index
+        data = np.full([len(coords[dim]) for dim in dims], np.nan,
+                       dtype=np.result_type(*[variable.dtype for variable in variables]))
+        for variable in variables:
+            variable = variable.transpose(*dims)
+            indexers = [coords[dim].get_indexer(variable.indexes[dim]) for dim in dims]
+            data[np.ix_(*indexers)] = variable.data
+        return xr.DataArray(data, coords=[(dim, coords[dim]) for dim in dims], dims=dims, name=name)
+
     def execute(self, first_data, second_data, **kwargs):
         if isinstance(first_data,xr.DataArray):
             first_data.attrs = {}
@@ -280,7 +443,7 @@ class XArrayCombine(ab.AnxcorDataTask):
             assert 'df' in attrs_2.keys(), 'no dataframe in 2!!! attrs is {}'.format(attrs_1)
             df_1 = attrs_1['df']
             df_2 = attrs_2['df']
-            attrs = {'df': pd.concat([df_1,df_2],ignore_index=True)}
+            attrs = {'df': os_utils.concat_metadata([df_1,df_2])}
             if attrs['df'].isnull().values.any():
                 print('isnull')
             return attrs
@@ -337,22 +500,8 @@ class XArrayStack(ab.XArrayProcessor):
     def _persist_metadata(self, xarray_1, xarray_2, *args, **kwargs):
         return  method_per_op(self._combine_metadata,self._getattr,xarray_1,xarray_2)
 
-    def _lambda_add(self,x_stacks,y_stacks):
-        return int(x_stacks + y_stacks)
-
     def _combine_metadata(self,attrs1, attrs2):
-        df_1 = attrs1['df']
-        df_2 = attrs2['df']
-        col_names= ['rec','src','src channel','rec channel','delta','operations']
-        if 'rec_latitude' in df_1.columns:
-            col_names = col_names + ['src_latitude','rec_latitude','src_longitude','rec_longitude']
-        if 'rec_elevation' in df_2.columns:
-            col_names = col_names + ['src_elevation','rec_elevation']
-        df_joined = df_1.merge(df_2,on=col_names,how='outer')
-        df_joined.fillna(0,inplace=True)
-        df_joined['stacks']= df_joined.apply(lambda x:   self._lambda_add(x['stacks_x'],x['stacks_y']),axis=1)
-        df_joined.drop(columns=['stacks_x','stacks_y'],inplace=True)
-        return {'df':df_joined}
+        return {'df':os_utils.stack_metadata([attrs1['df'],attrs2['df']])}
 
     def _getattr(self,array):
         return array.attrs
@@ -383,3 +532,407 @@ class XArrayStack(ab.XArrayProcessor):
 
 
 
+class XArrayStackAccumulator:
+    """
+    stacks correlation datasets in place as they finish
+
+    keeps one float buffer per data variable, covering every (src, rec, src_chan, rec_chan, time)
+    seen so far, and one metadata table whose integer 'stacks' column counts the windows added to
+    each pair and channel combination. Memory therefore scales with the stacked result, not with the
+    number of windows, and each window costs one vectorized add. Results are equivalent to
+    reducing the same datasets with XArrayStack.
+    """
+    def __init__(self):
+        self._buffers = {}
+        self._coords  = {}
+        self._dims    = {}
+        self._names   = []
+        self._filled  = set()
+        self._df      = None
+        self._windows = 0
+
+    def __len__(self):
+        return self._windows
+
+    def add(self, dataset: xr.Dataset):
+        """
+        adds a correlation dataset (a single window or a partial stack) to the running stack
+        """
+        if dataset is None:
+            return
+        self._windows += 1
+        for name in dataset.data_vars:
+            if name not in self._buffers:
+                self._start_buffer(name, dataset[name])
+            else:
+                self._add_to_buffer(name, dataset[name])
+        self._add_metadata(dataset.attrs['df'])
+
+    def result(self):
+        """
+        returns the stacked xr.Dataset, or None if nothing has been added
+        """
+        if not self._buffers:
+            return None
+        data_vars = {}
+        for name in self._names:
+            coords = [(dim, self._coords[name][dim].values) for dim in self._dims[name]]
+            data_vars[name] = xr.DataArray(self._buffers[name], coords=coords, name=name)
+        if len(data_vars) == 1:
+            result = data_vars[self._names[0]].to_dataset()
+        else:
+            result = xr.merge([data_vars[name].to_dataset() for name in self._names])
+        result.attrs = {'df': self._df.copy()}
+        return result
+
+    def _start_buffer(self, name, xarray):
+        self._names.append(name)
+        self._dims[name]    = xarray.dims
+        self._coords[name]  = {dim: xarray.indexes[dim] for dim in xarray.dims}
+        self._buffers[name] = np.array(xarray.data, dtype=np.float64)
+
+    def _add_to_buffer(self, name, xarray):
+        xarray = xarray.transpose(*self._dims[name])
+        if name not in self._filled:
+            np.nan_to_num(self._buffers[name], copy=False)
+            self._filled.add(name)
+        data = xarray.data
+        if self._coords_match(name, xarray):
+            buffer = self._buffers[name]
+            np.add(buffer, data, out=buffer, where=~np.isnan(data))
+        else:
+            buffer   = self._grow_buffer(name, xarray)
+            indexers = [self._coords[name][dim].get_indexer(xarray.indexes[dim]) for dim in self._dims[name]]
+            buffer[np.ix_(*indexers)] += np.nan_to_num(data)
+
+    def _coords_match(self, name, xarray):
+        return all(xarray.indexes[dim].equals(self._coords[name][dim]) for dim in self._dims[name])
+
+    def _grow_buffer(self, name, xarray):
+        old_coords = self._coords[name]
+        new_coords = {dim: old_coords[dim].union(xarray.indexes[dim]) for dim in self._dims[name]}
+        if all(new_coords[dim].equals(old_coords[dim]) for dim in self._dims[name]):
+            return self._buffers[name]
+        buffer   = np.zeros([len(new_coords[dim]) for dim in self._dims[name]], dtype=np.float64)
+        indexers = [new_coords[dim].get_indexer(old_coords[dim]) for dim in self._dims[name]]
+        buffer[np.ix_(*indexers)] = self._buffers[name]
+        self._coords[name]  = new_coords
+        self._buffers[name] = buffer
+        return buffer
+
+    def _add_metadata(self, df):
+        if self._df is None:
+            self._df = df.copy()
+            self._df['stacks'] = self._df['stacks'].astype(np.int64)
+            return
+        self._df = os_utils.stack_metadata([self._df, df])
+
+
+class ProcessingLedger:
+    """
+    records which (starttime, station pair) units have been correlated and where their partial
+    stacks are saved
+
+    the ledger is an append only log of json lines. Its first line holds the processing fingerprint,
+    and each checkpoint appends one line with the new partial stack, any station pairs not seen before
+    and the completed pairs of each of its windows. Pairs are numbered in order of first appearance and
+    completed pairs are stored as ranges of those numbers, so a window whose pairs all finished costs a
+    single range and a checkpoint only writes its own windows. An interrupted run can be resumed by
+    skipping completed units, and new windows can be appended to an existing stack by computing only the
+    windows missing from the ledger. Units are only recorded once their partial stack is on disk. A ledger
+    built with a different processing configuration is ignored.
+    """
+    LEDGER_FILE    = 'ledger.jsonl'
+    PARTIAL_PREFIX = 'partial_stack_'
+
+    def __init__(self, folder, fingerprint, resume=True, checkpoint=10):
+        self._folder        = folder
+        self._fingerprint   = fingerprint
+        self._pairs         = []
+        self._pair_index    = {}
+        self._units         = {}
+        self._partials      = []
+        self._partial_index = 0
+        self._rewrite       = True
+        self.checkpoint     = checkpoint
+        os_utils.make_dir(folder)
+        if resume:
+            self._load()
+
+    def _ledger_path(self):
+        return '{}{}{}'.format(self._folder, os_utils.sep, self.LEDGER_FILE)
+
+    def _load(self):
+        path = self._ledger_path()
+        if not os_utils.file_exists(path):
+            return
+        with open(path, 'r') as p_file:
+            lines = p_file.read().split('\n')
+        header  = json.loads(lines[0])
+        records = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # a checkpoint interrupted while being appended. Its units were never recorded
+                break
+        self._partial_index = max([header['partial_index']] + [record['partial_index'] for record in records])
+        if header['fingerprint'] != self._fingerprint:
+            print('ledger at {} was built with a different configuration. Ignoring completed windows'.format(path))
+            return
+        for record in records:
+            self._apply_record(record)
+        self._rewrite = len(records) != len([line for line in lines[1:] if line])
+
+    def _apply_record(self, record):
+        for pair_key in record['pairs']:
+            self._pair_index[pair_key] = len(self._pairs)
+            self._pairs.append(pair_key)
+        self._partials += record['partials']
+        for starttime, ranges in record['units'].items():
+            indices = np.concatenate([np.arange(start, stop) for start, stop in ranges] + [np.zeros(0, dtype=int)])
+            self._mark_complete(starttime, indices)
+
+    def _mark_complete(self, starttime, indices):
+        completed = self._units.get(starttime, np.zeros(0, dtype=bool))
+        if len(completed) < len(self._pairs):
+            completed = np.concatenate([completed, np.zeros(len(self._pairs) - len(completed), dtype=bool)])
+        completed[indices] = True
+        self._units[starttime] = completed
+
+    def _index_ranges(self, indices):
+        # sorted unique pair numbers as [start, stop) ranges
+        indices = np.unique(indices)
+        if not len(indices):
+            return []
+        breaks = np.flatnonzero(np.diff(indices) != 1)
+        starts = indices[np.concatenate([[0], breaks + 1])]
+        stops  = indices[np.concatenate([breaks, [len(indices) - 1]])] + 1
+        return [[int(start), int(stop)] for start, stop in zip(starts, stops)]
+
+    def _append(self, record):
+        if self._rewrite:
+            self._write_log()
+            return
+        with open(self._ledger_path(), 'a') as p_file:
+            p_file.write(json.dumps(record, sort_keys=True) + '\n')
+            p_file.flush()
+            os.fsync(p_file.fileno())
+
+    def _write_log(self):
+        header   = {'fingerprint': self._fingerprint, 'partial_index': self._partial_index}
+        snapshot = {'partial_index': self._partial_index,
+                    'partials'     : self._partials,
+                    'pairs'        : self._pairs,
+                    'units'        : {starttime: self._index_ranges(np.flatnonzero(completed))
+                                      for starttime, completed in self._units.items()}}
+        path     = self._ledger_path()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as p_file:
+            p_file.write(json.dumps(header, sort_keys=True) + '\n')
+            p_file.write(json.dumps(snapshot, sort_keys=True) + '\n')
+            p_file.flush()
+            os.fsync(p_file.fileno())
+        os.replace(tmp_path, path)
+        self._rewrite = False
+
+    def _starttime_key(self, starttime):
+        return '{:.6f}'.format(float(starttime))
+
+    def pending_mask(self, starttime, pair_keys):
+        """
+        returns a boolean array marking which of the pair keys are not yet completed at starttime
+        """
+        completed = self._units.get(self._starttime_key(starttime), np.zeros(0, dtype=bool))
+        indices   = np.asarray([self._pair_index.get(pair, len(completed)) for pair in pair_keys], dtype=int)
+        pending   = np.ones(len(indices), dtype=bool)
+        known     = indices < len(completed)
+        pending[known] = ~completed[indices[known]]
+        return pending
+
+    def is_complete(self, starttime, pair_key):
+        return not self.pending_mask(starttime, [pair_key])[0]
+
+    def commit(self, partial_stack, units):
+        """
+        saves a partial stack and records its (starttime, [pair keys]) units as completed
+        """
+        record = {'partials': [], 'pairs': [], 'units': {}}
+        if partial_stack is not None:
+            name = '{}{}'.format(self.PARTIAL_PREFIX, self._partial_index)
+            self._partial_index += 1
+            ab.write(self._encode_time(partial_stack), self._folder, name)
+            self._partials.append(name)
+            record['partials'].append(name)
+        window_indices = {}
+        for starttime, pair_keys in units:
+            for pair_key in pair_keys:
+                if pair_key not in self._pair_index:
+                    self._pair_index[pair_key] = len(self._pairs)
+                    self._pairs.append(pair_key)
+                    record['pairs'].append(pair_key)
+            indices = [self._pair_index[pair_key] for pair_key in pair_keys]
+            window_indices.setdefault(self._starttime_key(starttime), []).extend(indices)
+        for key, indices in window_indices.items():
+            indices = np.asarray(indices, dtype=int)
+            self._mark_complete(key, indices)
+            record['units'][key] = self._index_ranges(indices)
+        record['partial_index'] = self._partial_index
+        self._append(record)
+
+    def consolidate(self):
+        """
+        merges every saved partial stack into one, replacing the partial files on disk, and returns it
+        """
+        if not self._partials:
+            return None
+        if len(self._partials) == 1:
+            return self._read_partial(self._partials[0])
+        accumulator = XArrayStackAccumulator()
+        for name in self._partials:
+            accumulator.add(self._read_partial(name))
+        result       = accumulator.result()
+        old_partials = self._partials
+        self._partials = []
+        self._rewrite  = True
+        self.commit(result, [])
+        for name in old_partials:
+            self._delete_partial(name)
+        return result
+
+    def _read_partial(self, name):
+        dataset = ab.read(self._folder, name)
+        if dataset is None:
+            return None
+        dataset.load()
+        dataset.close()
+        return self._decode_time(dataset)
+
+    def _encode_time(self, dataset):
+        # netcdf time units would round the lag coordinates, so store them as nanoseconds. float64 keeps
+        # them exact and also fits netcdf3 files, which have no 64 bit integers
+        encoded = dataset.assign_coords(time=dataset.coords['time'].values.astype(np.int64).astype(np.float64))
+        encoded.attrs = dataset.attrs
+        return encoded
+
+    def _decode_time(self, dataset):
+        attrs   = dataset.attrs
+        decoded = dataset.assign_coords(time=dataset.coords['time'].values.astype(np.int64).astype('datetime64[ns]'))
+        decoded.attrs = attrs
+        return decoded
+
+    def _delete_partial(self, name):
+        for extension in ['.nc', '.metadata.npz', '.metadata.csv']:
+            path = '{}{}{}{}'.format(self._folder, os_utils.sep, name, extension)
+            if os_utils.file_exists(path):
+                os_utils.delete_file(path)
+
+
+class WindowBudget:
+    """
+    bounds how many correlation windows are held at once
+
+    the bound is either a number of windows, a memory budget in bytes, or both. A byte budget is turned
+    into a number of windows from the largest window observed so far, so only one window is allowed in
+    flight until the first one has been measured.
+    """
+
+    def __init__(self, max_windows_in_flight=None, memory_budget=None):
+        self._max_windows   = max_windows_in_flight
+        self._memory_budget = memory_budget
+        self._window_bytes  = None
+
+    def is_bounded(self):
+        return self._max_windows is not None or self._memory_budget is not None
+
+    def observe(self, dataset):
+        """
+        records the size of a finished window or partial stack
+        """
+        if isinstance(dataset, (xr.Dataset, xr.DataArray)):
+            nbytes = dataset.nbytes
+            if self._window_bytes is None or nbytes > self._window_bytes:
+                self._window_bytes = nbytes
+
+    def windows_allowed(self):
+        """
+        returns the number of windows that may be held at once, or None if unbounded
+        """
+        limits = []
+        if self._max_windows is not None:
+            limits.append(self._max_windows)
+        if self._memory_budget is not None:
+            if self._window_bytes is None:
+                limits.append(1)
+            else:
+                limits.append(self._memory_budget // self._window_bytes)
+        if not limits:
+            return None
+        return max(1, int(min(limits)))
+
+    def must_flush(self, held_windows):
+        """
+        True when the held windows should be stacked into a single partial stack
+        """
+        allowed = self.windows_allowed()
+        return allowed is not None and held_windows >= max(2, allowed)
+
+
+class WindowPrefetcher:
+    """
+    loads upcoming windows in a background thread
+
+    load_window(starttime, stations) is called for each (starttime, stations) item in order, and its result is
+    put on a bounded queue holding at most depth windows, so reads overlap with the work done on earlier
+    windows while memory stays capped. Exceptions raised while loading are re-raised by get().
+    """
+    _DONE = object()
+
+    def __init__(self, load_window, windows, depth=1):
+        self._load_window = load_window
+        self._windows     = list(windows)
+        self._queue       = queue.Queue(maxsize=max(1, depth))
+        self._stop        = threading.Event()
+        self._thread      = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for starttime, stations in self._windows:
+            if self._stop.is_set():
+                return
+            try:
+                item = (starttime, self._load_window(starttime, stations), None)
+            except Exception as exception:
+                item = (starttime, None, exception)
+            if not self._put(item):
+                return
+        self._put((None, self._DONE, None))
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self):
+        """
+        returns (starttime, loaded window) for the next window in order
+        """
+        starttime, loaded, exception = self._queue.get()
+        if exception is not None:
+            raise exception
+        return starttime, loaded
+
+    def close(self):
+        self._stop.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
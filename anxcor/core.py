@@ -1,15 +1,95 @@
-from  anxcor.containers import DataLoader, XArrayCombine, XArrayStack
-from  anxcor.xarray_routines import XArrayConverter, XArrayResample, XArrayXCorrelate
-from anxcor.abstractions import NullTask, NullDualTask
+from  anxcor.containers import DataLoader, XArrayCombine, XArrayStack, XArrayStackAccumulator, ProcessingLedger, \
+    WindowBudget, WindowPrefetcher
+from  anxcor.xarray_routines import XArrayConverter, XArrayResample, XArrayXCorrelate, execute_fused_chain
+from anxcor.abstractions import NullTask, NullDualTask, NETCDF_FORMAT
 import xarray as xr
 import numpy as np
 import itertools
 from obspy.core import UTCDateTime, Stream, Trace
-from obspy.geodetics.base import gps2dist_azimuth
+from obspy.geodetics.base import gps2dist_azimuth, WGS84_F
 import json
 import pandas as pd
 import anxcor.utils as utils
+import os
 import copy
+import concurrent.futures
+
+EARTH_RADIUS_KM = 6371.0
+VINCENTY_ITERATIONS = 100
+ALIGN_PAIR_BATCH    = 256
+MMAP_FORMAT      = 'mmap'
+RESULT_FORMATS   = [NETCDF_FORMAT, MMAP_FORMAT]
+MMAP_DESCRIPTION = 'result.json'
+MMAP_METADATA    = 'metadata.npz'
+
+def _process_worker_windows(anxcor, station_pairs, starttimes):
+    # the pool gets one task per worker, so the configuration travels once per worker with its windows
+    anxcor._ledger_folder = None
+    return anxcor._process_serial(starttimes, station_pairs)
+
+def _station_window_task(anxcor, station, starttime):
+    # one coarse dask task per station and window: load, convert and every process step
+    return anxcor._get_station_window(station, starttime, {})
+
+def _window_correlation_task(anxcor, starttime, station_pairs, stations, *station_windows):
+    # one coarse dask task per window: correlate, post-correlate, combine and post-combine
+    fingerprint   = anxcor._get_process_fingerprint()
+    station_cache = {(station, starttime, fingerprint): window for station, window in zip(stations, station_windows)}
+    return anxcor._iterate_over_pairs(starttime, station_pairs, station_cache=station_cache)
+
+def _great_circle_distance_km(lat_1, lon_1, lat_2, lon_2):
+    # haversine distance on a sphere, vectorized over numpy arrays of degrees
+    lat_1, lon_1, lat_2, lon_2 = [np.deg2rad(angle) for angle in (lat_1, lon_1, lat_2, lon_2)]
+    a = np.sin((lat_2 - lat_1) / 2)**2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def _rotate_pair_blocks(blocks, rotate, rotation_a, rotation_b):
+    # blocks are (pair, time, src_chan, rec_chan). zero samples are missing, and autocorrelations are not rotated
+    blocks = np.asarray(blocks, dtype=np.float64)
+    blocks[blocks == 0] = np.nan
+    blocks[rotate] = np.einsum('pij,ptjk,pkl->ptil', rotation_a, blocks[rotate], rotation_b)
+    return blocks
+
+def _vincenty_azimuths(lat_1, lon_1, lat_2, lon_2):
+    # azimuth and back azimuth in degrees on the WGS84 ellipsoid, vectorized over numpy arrays of degrees.
+    # follows obspy's calc_vincenty_inverse. Pairs that do not converge (near antipodes) are returned as nan
+    lat_1, lon_1, lat_2, lon_2 = [np.deg2rad(np.asarray(angle, dtype=np.float64)) for angle in (lat_1, lon_1, lat_2, lon_2)]
+    u_1   = np.arctan((1 - WGS84_F) * np.tan(lat_1))
+    u_2   = np.arctan((1 - WGS84_F) * np.tan(lat_2))
+    omega = lon_2 - lon_1
+    dlon  = omega.copy()
+    active = np.ones(dlon.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(VINCENTY_ITERATIONS):
+            if not active.any():
+                break
+            sin_sigma = np.sqrt((np.cos(u_2) * np.sin(dlon))**2 +
+                                (np.cos(u_1) * np.sin(u_2) - np.sin(u_1) * np.cos(u_2) * np.cos(dlon))**2)
+            cos_sigma = np.sin(u_1) * np.sin(u_2) + np.cos(u_1) * np.cos(u_2) * np.cos(dlon)
+            sigma     = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.cos(u_1) * np.cos(u_2) * np.sin(dlon) / sin_sigma
+            sqr_cos_alpha = 1 - sin_alpha * sin_alpha
+            cos2sigma_m   = np.where(sqr_cos_alpha == 0, 0,
+                                     cos_sigma - 2 * np.sin(u_1) * np.sin(u_2) / sqr_cos_alpha)
+            c = (WGS84_F / 16) * sqr_cos_alpha * (4 + WGS84_F * (4 - 3 * sqr_cos_alpha))
+            new_dlon = omega + (1 - c) * WGS84_F * sin_alpha * \
+                (sigma + c * sin_sigma * (cos2sigma_m + c * cos_sigma * (-1 + 2 * cos2sigma_m**2)))
+            new_dlon = np.where(active, new_dlon, dlon)
+            converged = (new_dlon == 0) | (np.abs((dlon - new_dlon) / new_dlon) <= 1e-9)
+            dlon   = new_dlon
+            active = active & ~converged
+    azimuth      = np.arctan2(np.cos(u_2) * np.sin(dlon),
+                              np.cos(u_1) * np.sin(u_2) - np.sin(u_1) * np.cos(u_2) * np.cos(dlon))
+    back_azimuth = np.arctan2(np.cos(u_1) * np.sin(dlon),
+                              -np.sin(u_1) * np.cos(u_2) + np.cos(u_1) * np.sin(u_2) * np.cos(dlon)) + np.pi
+    azimuth      = np.rad2deg(np.mod(azimuth, 2 * np.pi))
+    back_azimuth = np.rad2deg(np.mod(back_azimuth, 2 * np.pi))
+    azimuth[active]      = np.nan
+    back_azimuth[active] = np.nan
+    coincident = (lat_1 == lat_2) & (lon_1 == lon_2)
+    azimuth[coincident]      = 0.0
+    back_azimuth[coincident] = 0.0
+    return azimuth, back_azimuth
 
 class _AnxcorProcessor:
 
@@ -20,6 +100,12 @@ class _AnxcorProcessor:
 
     def _station_window_operations(self, channels, dask_client=None, starttime=None, station=None):
         xarray       = self._get_task('xconvert')(channels, starttime=starttime, station=station, dask_client=dask_client )
+        return self._process_station_window(xarray, dask_client=dask_client, starttime=starttime, station=station)
+
+    def _process_station_window(self, xarray, dask_client=None, starttime=None, station=None):
+        if self._fused_processing:
+            return self._fused_station_window_operations(xarray, dask_client=dask_client,
+                                                         starttime=starttime, station=station)
         tasks        = [xarray]
         process_list = self._get_process_order()
         for process_key in process_list:
@@ -30,8 +116,29 @@ class _AnxcorProcessor:
 
         return tasks[0]
 
-
-    def process(self,starttimes, dask_client=None,stack=False,**kwargs):
+    def _fused_station_window_operations(self, xarray, dask_client=None, starttime=None, station=None):
+        fused = []
+        for process_key in self._get_process_order():
+            process = self._get_process(process_key)
+            if process._can_fuse():
+                fused.append(process)
+                continue
+            xarray = self._launch_fused_chain(fused, xarray, dask_client=dask_client, starttime=starttime, station=station)
+            fused  = []
+            xarray = process(xarray, starttime=starttime, station=station, dask_client=dask_client)
+        return self._launch_fused_chain(fused, xarray, dask_client=dask_client, starttime=starttime, station=station)
+
+    def _launch_fused_chain(self, processes, xarray, dask_client=None, starttime=None, station=None):
+        if not processes:
+            return xarray
+        last = processes[-1]
+        key  = 'fused ' + last._get_operation_key(starttime=starttime, station=station)
+        return last._launch_window_task(execute_fused_chain, processes, xarray, dask_client=dask_client, key=key,
+                                        starttime=starttime, station=station)
+
+
+    def process(self,starttimes, dask_client=None,stack=False,processes=None,granularity='operation',
+                max_windows_in_flight=None,memory_budget=None,prefetch=0,**kwargs):
 
         station_pairs = self.get_station_combinations()
         if station_pairs.empty:
@@ -40,18 +147,219 @@ class _AnxcorProcessor:
         else:
             if self._verbose >= 1:
                 print('correlating {} station-pairs'.format(len(station_pairs.index)))
+        if dask_client is None and processes is not None and processes > 1:
+            if self._ledger_folder is not None:
+                print('the ledger requires serial execution with in place stacking. Ignoring ledger')
+            return self._process_pool(starttimes, station_pairs, processes)
+        if self._can_accumulate_stack(dask_client):
+            return self._process_accumulated(starttimes, station_pairs, ledger=self._get_ledger(), prefetch=prefetch)
+        elif self._ledger_folder is not None:
+            print('the ledger requires serial execution with in place stacking. Ignoring ledger')
+        budget = WindowBudget(max_windows_in_flight=max_windows_in_flight, memory_budget=memory_budget)
+        if dask_client is not None and granularity=='window':
+            return self._process_dask_windows(starttimes, station_pairs, dask_client, budget=budget)
+        self._task_snapshots = {} if dask_client is not None else None
+        try:
+            return self._process_windows(starttimes, station_pairs, dask_client=dask_client, stack=stack,
+                                         budget=budget, prefetch=prefetch)
+        finally:
+            self._task_snapshots = None
+
+    def _process_serial(self, starttimes, station_pairs):
+        if self._can_accumulate_stack(None):
+            return self._process_accumulated(starttimes, station_pairs)
+        return self._process_windows(starttimes, station_pairs)
+
+    def _process_pool(self, starttimes, station_pairs, processes):
+        """
+        splits the windows round robin over a pool of worker processes. Each worker stacks its own
+        windows, and the partial stacks are merged as they finish
+        """
+        processes = min(processes, len(starttimes))
+        chunks    = [starttimes[worker::processes] for worker in range(processes)]
+        if self._verbose >= 1:
+            print('processing {} windows on {} processes'.format(len(starttimes), processes))
+        partial_stacks = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_process_worker_windows, self, station_pairs, chunk) for chunk in chunks]
+            for future in concurrent.futures.as_completed(futures):
+                partial_stacks.append(future.result())
+        partial_stacks = [partial for partial in partial_stacks if partial is not None]
+        if not partial_stacks:
+            return None
+        if self._can_accumulate_stack(None):
+            accumulator = XArrayStackAccumulator()
+            for partial in partial_stacks:
+                accumulator.add(partial)
+            return accumulator.result()
+        return self._prepare_results(None, partial_stacks)[0]
+
+    def _process_dask_windows(self, starttimes, station_pairs, dask_client, budget=None):
+        """
+        submits one task per station window chain and one correlate-and-combine task per window,
+        so the graph grows with windows x stations rather than with individual operations.
+        The configured Anxcor is scattered to the workers once, and finished windows are stacked
+        as they arrive. With a bounded budget, new windows are only submitted as earlier ones finish
+        """
+        from distributed import as_completed
+        if budget is None:
+            budget = WindowBudget()
+        snapshot  = dask_client.scatter(self, broadcast=True)
+        stations  = sorted(set(station_pairs['source'].values) | set(station_pairs['receiver'].values))
+        remaining = list(starttimes)[::-1]
+        in_flight = as_completed()
+        self._submit_dask_windows(dask_client, snapshot, station_pairs, stations, remaining, in_flight, budget)
+        accumulator = XArrayStackAccumulator() if self._can_accumulate_stack(None) else None
+        held        = []
+        for future in in_flight:
+            result = future.result()
+            future.release()
+            budget.observe(result)
+            if accumulator is not None:
+                accumulator.add(result)
+            elif result is not None:
+                held.append(result)
+                if budget.must_flush(len(held)):
+                    held = self._prepare_results(None, held)
+            self._submit_dask_windows(dask_client, snapshot, station_pairs, stations, remaining, in_flight, budget)
+        if accumulator is not None:
+            return accumulator.result()
+        if not held:
+            return None
+        return self._prepare_results(None, held)[0]
+
+    def _submit_dask_windows(self, dask_client, snapshot, station_pairs, stations, remaining, in_flight, budget):
+        allowed = budget.windows_allowed()
+        while remaining and (allowed is None or in_flight.count() < allowed):
+            starttime = remaining.pop()
+            if self._verbose >=2:
+                print('submitting window {}'.format(UTCDateTime(starttime)))
+            window_key = UTCDateTime(starttime).strftime(self.time_format)
+            station_windows = [dask_client.submit(_station_window_task, snapshot, station, starttime,
+                                                  key='station window: {}@{}'.format(station, window_key))
+                               for station in stations]
+            in_flight.add(dask_client.submit(_window_correlation_task, snapshot, starttime, station_pairs,
+                                             stations, *station_windows,
+                                             key='window correlation: {}'.format(window_key)))
+
+    def _process_windows(self, starttimes, station_pairs, dask_client=None, stack=False, budget=None, prefetch=0):
+        if budget is None:
+            budget = WindowBudget()
+        if dask_client is not None:
+            prefetch = 0
         futures = []
-        for starttime in starttimes:
+        windows = [(starttime, station_pairs) for starttime in starttimes]
+        for starttime, pairs, station_cache in self._iterate_windows(windows, prefetch=prefetch):
             if self._verbose >=2:
                 print('processing window {}'.format(UTCDateTime(starttime)))
-            correlation_dataset  = self._iterate_over_pairs(starttime, station_pairs, dask_client=dask_client)
+            correlation_dataset  = self._iterate_over_pairs(starttime, pairs, dask_client=dask_client,
+                                                            station_cache=station_cache)
+            budget.observe(correlation_dataset)
             futures.append(correlation_dataset)
-            futures = self._stack_futures(futures,stack,dask_client)
+            if budget.must_flush(len(futures)):
+                if self._verbose >= 1:
+                    print('window budget reached. flushing partial stack')
+                futures = self._prepare_results(dask_client, futures)
+                budget.observe(futures[0])
+            else:
+                futures = self._stack_futures(futures,stack,dask_client)
 
         combined_crosscorrelations = self._prepare_results(dask_client, futures)
+        self._flush_pending_writes(dask_client)
 
         return combined_crosscorrelations[0]
 
+    def _can_accumulate_stack(self, dask_client):
+        stack_task = self._tasks['stack']
+        return dask_client is None and type(stack_task) is XArrayStack and \
+            stack_task._parent_can_process() and not stack_task.has_io_enabled()
+
+    def _process_accumulated(self, starttimes, station_pairs, ledger=None, prefetch=0):
+        """
+        serial execution which adds each window to an in place stack as soon as it is correlated.
+        With a ledger, completed (starttime, pair) units are skipped and partial stacks are committed
+        every ledger.checkpoint windows
+        """
+        accumulator = XArrayStackAccumulator()
+        completed   = []
+        pair_keys   = np.asarray([self.CORR_FORMAT.format(source, receiver) for source, receiver in
+                                  zip(station_pairs['source'].values, station_pairs['receiver'].values)])
+        windows     = []
+        for starttime in starttimes:
+            pairs = station_pairs
+            if ledger is not None:
+                pending = ledger.pending_mask(starttime, pair_keys)
+                if not pending.any():
+                    if self._verbose >= 2:
+                        print('window {} already stacked. skipping'.format(UTCDateTime(starttime)))
+                    continue
+                pairs = station_pairs[pending]
+            windows.append((starttime, pairs))
+        for starttime, pairs, station_cache in self._iterate_windows(windows, prefetch=prefetch):
+            if self._verbose >=2:
+                print('processing window {}'.format(UTCDateTime(starttime)))
+            correlation_dataset = self._iterate_over_pairs(starttime, pairs, station_cache=station_cache)
+            accumulator.add(correlation_dataset)
+            if ledger is not None:
+                completed.append((starttime, self._get_correlated_pairs(correlation_dataset)))
+                if len(completed) >= ledger.checkpoint:
+                    ledger.commit(accumulator.result(), completed)
+                    accumulator = XArrayStackAccumulator()
+                    completed   = []
+        if self._verbose >= 1:
+            print('stacked {} windows'.format(len(accumulator)))
+        if ledger is None:
+            return accumulator.result()
+        if completed:
+            ledger.commit(accumulator.result(), completed)
+        return ledger.consolidate()
+
+    def _iterate_windows(self, windows, prefetch=0):
+        """
+        yields (starttime, station pairs, station cache) for each window. With prefetch > 0, a background
+        thread loads and converts up to prefetch windows ahead of the one being correlated
+        """
+        if prefetch <= 0:
+            for starttime, pairs in windows:
+                yield starttime, pairs, None
+            return
+        stations    = [(starttime, self._get_pair_stations(pairs)) for starttime, pairs in windows]
+        prefetcher  = WindowPrefetcher(self._load_and_convert_window, stations, depth=prefetch)
+        fingerprint = self._get_process_fingerprint()
+        try:
+            for starttime, pairs in windows:
+                _, converted  = prefetcher.get()
+                station_cache = {}
+                for station, xarray in converted.items():
+                    # windows missing from the database, or loaded by a process, still go through the chain
+                    station_cache[(station, starttime, fingerprint)] = self._process_station_window(
+                        xarray, starttime=starttime, station=station)
+                yield starttime, pairs, station_cache
+        finally:
+            prefetcher.close()
+
+    def _get_pair_stations(self, station_pairs):
+        return list(pd.unique(np.concatenate([station_pairs['source'].values, station_pairs['receiver'].values])))
+
+    def _load_and_convert_window(self, starttime, stations):
+        self._bulk_prefetch(starttime, stations)
+        converted = {}
+        try:
+            for station in stations:
+                channels = self._get_task('data')(starttime=starttime, station=station)
+                converted[station] = self._get_task('xconvert')(channels, starttime=starttime, station=station)
+        finally:
+            if hasattr(self._tasks['data'], 'discard_prefetched'):
+                self._tasks['data'].discard_prefetched(starttime)
+        return converted
+
+    def _get_correlated_pairs(self, correlation_dataset):
+        if correlation_dataset is None:
+            return []
+        df    = correlation_dataset.attrs['df']
+        pairs = df[['src', 'rec']].drop_duplicates()
+        return [self.CORR_FORMAT.format(src, rec) for src, rec in zip(pairs['src'].values, pairs['rec'].values)]
+
     def _stack_futures(self,futures,stack,dask_client):
         result=None
         if isinstance(stack, int):
@@ -72,33 +380,64 @@ class _AnxcorProcessor:
         else:
             return futures
         if dask_client is not None:
-            result = result.compute()
+            import dask
+            result = dask.compute(result, *self._pop_pending_writes())[0]
         return [result]
 
-    def _iterate_over_pairs(self, starttime, station_pairs, dask_client=None):
+    def _pop_pending_writes(self):
+        tasks = list(self._tasks['process'].values())
+        tasks+= [task for key, task in self._tasks.items() if key!='process']
+        if self._task_snapshots is not None:
+            tasks+= list(self._task_snapshots.values())
+        pending = []
+        for task in tasks:
+            pending+= task.pop_pending_writes()
+        return pending
+
+    def _flush_pending_writes(self, dask_client):
+        pending = self._pop_pending_writes()
+        if dask_client is not None and pending:
+            import dask
+            dask.compute(*pending)
+
+    def _iterate_over_pairs(self, starttime, station_pairs, dask_client=None, station_cache=None):
+        if station_cache is None:
+            station_cache = {}
+        fingerprint       = self._get_process_fingerprint()
+        if dask_client is None:
+            self._prefetch_window(starttime, station_pairs, station_cache, fingerprint)
+        try:
+            if self._use_batch_correlation():
+                return self._correlate_window_batch(starttime, station_pairs, station_cache,
+                                                    fingerprint=fingerprint, dask_client=dask_client)
+            return self._correlate_window_pairs(starttime, station_pairs, station_cache,
+                                                fingerprint=fingerprint, dask_client=dask_client)
+        finally:
+            if dask_client is None and hasattr(self._tasks['data'], 'discard_prefetched'):
+                self._tasks['data'].discard_prefetched(starttime)
+
+    def _prefetch_window(self, starttime, station_pairs, station_cache, fingerprint):
+        stations = self._get_pair_stations(station_pairs)
+        stations = [station for station in stations if (station, starttime, fingerprint) not in station_cache]
+        self._bulk_prefetch(starttime, stations)
+
+    def _bulk_prefetch(self, starttime, stations):
+        """
+        asks bulk capable databases for every station of the window in one call
+        """
+        data_task = self._tasks['data']
+        if not hasattr(data_task, 'prefetch') or not data_task._parent_can_process() or data_task.read.is_enabled():
+            return
+        if stations:
+            data_task.prefetch(stations, [starttime])
+
+    def _correlate_window_pairs(self, starttime, station_pairs, station_cache, fingerprint=None, dask_client=None):
         correlation_stack = []
-        for index, row in station_pairs.iterrows():
-            source   = row['source']
-            receiver = row['receiver']
-            source_channels = self._get_task('data',dask_client=dask_client)(
-                                                  starttime=starttime,
-                                                  station=source,
-                                                  dask_client=dask_client)
-            source_ch_ops = self._station_window_operations(source_channels,
-                                                            starttime=starttime,
-                                                            station=source,
-                                                            dask_client=dask_client)
-            if source==receiver:
-                receiver_ch_ops   = source_ch_ops
-            else:
-                receiver_channels = self._get_task('data',dask_client=dask_client)(
-                                                      starttime=starttime,
-                                                      station=receiver,
-                                                      dask_client=dask_client)
-                receiver_ch_ops   = self._station_window_operations(receiver_channels,
-                                                                starttime=starttime,
-                                                                station=receiver,
-                                                                dask_client=dask_client)
+        for source, receiver in zip(station_pairs['source'].values, station_pairs['receiver'].values):
+            source_ch_ops   = self._get_station_window(source, starttime, station_cache,
+                                                       fingerprint=fingerprint, dask_client=dask_client)
+            receiver_ch_ops = self._get_station_window(receiver, starttime, station_cache,
+                                                       fingerprint=fingerprint, dask_client=dask_client)
             corr_station = self.CORR_FORMAT.format(source,receiver)
             correlation = self._get_task('crosscorrelate')(source_ch_ops,
                                                    receiver_ch_ops,
@@ -114,7 +453,10 @@ class _AnxcorProcessor:
                                                           dask_client=dask_client)
 
 
-        combined_crosscorrelations = self._reduce(correlation_stack,
+        if self._use_single_pass_combine():
+            combined_crosscorrelations = self._combine_single_pass(correlation_stack, starttime, dask_client=dask_client)
+        else:
+            combined_crosscorrelations = self._reduce(correlation_stack,
                                                   station=UTCDateTime(starttime).strftime(self.time_format),
                                                   reducing_func=self._get_task('combine'),
                                                   dask_client=dask_client)
@@ -127,6 +469,73 @@ class _AnxcorProcessor:
         return combined_crosscorrelations
 
 
+    def _use_single_pass_combine(self):
+        combine = self._tasks['combine']
+        if not self._single_pass_combine or not hasattr(combine, 'combine_all'):
+            return False
+        # subclasses inheriting combine_all may customize execute or _persist_metadata, which it would skip
+        if type(combine) is not XArrayCombine and 'combine_all' not in vars(type(combine)):
+            return False
+        return combine._parent_can_process() and not combine.has_io_enabled()
+
+    def _combine_single_pass(self, correlation_stack, starttime, dask_client=None):
+        combine = self._get_task('combine', dask_client=dask_client)
+        key     = 'single pass ' + combine._get_operation_key(starttime=starttime, station='all')
+        return combine._launch_window_task(combine.combine_all, correlation_stack, dask_client=dask_client, key=key)
+
+    def _use_batch_correlation(self):
+        correlator = self._tasks['crosscorrelate']
+        if not hasattr(correlator, 'execute_window') or correlator.get_kwargs().get('engine', None) != 'batch':
+            return False
+        if not correlator._parent_can_process():
+            return False
+        # the batch pass skips post-correlate and the combine reduction, so custom tasks there keep the pair path
+        if type(self._tasks['combine']) is not XArrayCombine or type(self._tasks['post-correlate']) is not NullTask:
+            return False
+        for key in ['crosscorrelate', 'post-correlate', 'combine']:
+            if self._tasks[key].has_io_enabled():
+                return False
+        return True
+
+    def _correlate_window_batch(self, starttime, station_pairs, station_cache, fingerprint=None, dask_client=None):
+        """
+        correlates every pair of a window in one vectorized pass, bypassing per-pair correlation,
+        post-correlate and the combine reduction
+        """
+        sources   = list(station_pairs['source'].values)
+        receivers = list(station_pairs['receiver'].values)
+        station_windows = {}
+        for station in sources + receivers:
+            if station not in station_windows:
+                station_windows[station] = self._get_station_window(station, starttime, station_cache,
+                                                                    fingerprint=fingerprint, dask_client=dask_client)
+        correlator = self._get_task('crosscorrelate', dask_client=dask_client)
+        combined_crosscorrelations = correlator.correlate_window(station_windows, sources, receivers,
+                                                                 starttime=starttime, dask_client=dask_client)
+        combined_crosscorrelations = self._get_task('post-combine')(combined_crosscorrelations,
+                                                  station='all',
+                                                  starttime=starttime,
+                                                  dask_client=dask_client)
+        return combined_crosscorrelations
+
+    def _get_station_window(self, station, starttime, station_cache, fingerprint=None, dask_client=None):
+        """
+        loads and preprocesses a single station window, reusing the result for every pair the station belongs to.
+        Products are keyed on (station, starttime, process chain fingerprint)
+        """
+        if fingerprint is None:
+            fingerprint = self._get_process_fingerprint()
+        key = (station, starttime, fingerprint)
+        if key not in station_cache:
+            channels = self._get_task('data',dask_client=dask_client)(starttime=starttime,
+                                                                     station=station,
+                                                                     dask_client=dask_client)
+            station_cache[key] = self._station_window_operations(channels,
+                                                                 starttime=starttime,
+                                                                 station=station,
+                                                                 dask_client=dask_client)
+        return station_cache[key]
+
     def _reduce(self,
                 future_stack,
                 station = None,
@@ -178,6 +587,7 @@ class _AnxcorData:
         self._station_pair_exclude   = []
         self._single_station_exclude = []
         self._window_length=window_length
+        self._distance_range = (None, None)
         self._tasks = {
             'data': DataLoader(**kwargs),
             'xconvert': XArrayConverter(),
@@ -193,6 +603,11 @@ class _AnxcorData:
             'post-stack':   NullTask('post-stack')
             }
         self._process_order = []
+        self._ledger_folder = None
+        self._ledger_kwargs = {}
+        self._task_snapshots = None
+        self._fused_processing = False
+        self._single_pass_combine = False
 
     def _get_anxcor_config_dict(self):
         return {'source_stations': self._single_station_include,
@@ -266,25 +681,115 @@ class _AnxcorData:
     def get_window_length(self):
         return self._tasks['data'].get_kwargs()['window_length']
 
+    def set_station_distance_range(self, min_distance=None, max_distance=None):
+        """
+        only correlates station pairs whose great circle separation in km lies within [min_distance, max_distance].
+        Requires databases which implement get_station_coordinates(). Pairs without coordinates are excluded
+        """
+        self._distance_range = (min_distance, max_distance)
+
+    def set_fused_processing(self, fused=True):
+        """
+        runs consecutive built-in station processors as one numpy pass over each station window,
+        building the window's metadata once at the end. Processors without a numpy kernel, disabled
+        processors and processors saving or loading intermediate results keep the per-process path
+        """
+        self._fused_processing = fused
+
+    def set_single_pass_combine(self, single_pass=True):
+        """
+        combines the pair correlations of each window in one pass into preallocated arrays,
+        instead of reducing them pairwise. Combine tasks saving or loading results, and custom
+        combine tasks that do not define their own combine_all, keep the pairwise reduction
+        """
+        self._single_pass_combine = single_pass
+
     def get_station_combinations(self):
-        stations = self._tasks['data'].get_stations()
-        station_pairs = list(itertools.combinations_with_replacement(stations, 2))
-        df = pd.DataFrame(station_pairs, columns=['source', 'receiver'])
+        stations, source_index, receiver_index = self._get_pair_index()
+        df = pd.DataFrame({'source': stations[source_index], 'receiver': stations[receiver_index]},
+                          columns=['source', 'receiver'])
+        return df
+
+    def _get_pair_index(self):
+        """
+        returns the station array and the integer source and receiver indices of every pair to correlate.
+        Pairs are the combinations with replacement of all stations, filtered by the include, exclude and
+        distance rules
+        """
+        stations = np.asarray(self._tasks['data'].get_stations(), dtype=object)
+        source_index, receiver_index = np.triu_indices(len(stations))
+        keep = np.ones(len(source_index), dtype=bool)
         # ok first must include
         if self._station_pair_include:
-            df = df[df['source'].isin(self._station_pair_include) & df['receiver'].isin(self._station_pair_include)]
-
-        elif  self._single_station_include:
-            df=df[df['source'].isin(self._single_station_include) | df['receiver'].isin(self._single_station_include)]
+            included = np.isin(stations, self._station_pair_include)
+            keep    &= included[source_index] & included[receiver_index]
 
-        # then exclude
+        elif self._single_station_include:
+            included = np.isin(stations, self._single_station_include)
+            keep    &= included[source_index] | included[receiver_index]
 
         # then must exclude
-
         if self._single_station_exclude:
-            df = df[(~df['receiver'].isin(self._single_station_exclude)) &
-                    (~df['source'].isin(self._single_station_exclude))]
-        return df
+            excluded = np.isin(stations, self._single_station_exclude)
+            keep    &= ~excluded[source_index] & ~excluded[receiver_index]
+
+        if self._distance_range != (None, None):
+            keep &= self._pairs_within_distance(stations, source_index, receiver_index)
+
+        return stations, source_index[keep], receiver_index[keep]
+
+    def _pairs_within_distance(self, stations, source_index, receiver_index):
+        coordinates = self._tasks['data'].get_station_coordinates()
+        latitudes   = np.asarray([coordinates.get(station, (np.nan, np.nan))[0] for station in stations], dtype=float)
+        longitudes  = np.asarray([coordinates.get(station, (np.nan, np.nan))[1] for station in stations], dtype=float)
+        if np.isnan(latitudes).any():
+            print('{} stations have no coordinates and are excluded by the distance range'.format(
+                np.isnan(latitudes).sum()))
+        distance = _great_circle_distance_km(latitudes[source_index], longitudes[source_index],
+                                             latitudes[receiver_index], longitudes[receiver_index])
+        min_distance, max_distance = self._distance_range
+        within = ~np.isnan(distance)
+        with np.errstate(invalid='ignore'):
+            if min_distance is not None:
+                within &= distance >= min_distance
+            if max_distance is not None:
+                within &= distance <= max_distance
+        return within
+
+    def _get_process_fingerprint(self):
+        chain = [('data', self._tasks['data'].get_kwargs()),
+                 ('xconvert', self._tasks['xconvert'].get_kwargs())]
+        for process_key in self._process_order:
+            chain.append((process_key, self._tasks['process'][process_key].get_kwargs()))
+        return json.dumps(chain, sort_keys=True, default=str)
+
+    def _get_ledger_fingerprint(self):
+        chain = [('process', self._get_process_fingerprint())]
+        for key in ['crosscorrelate', 'post-correlate', 'combine', 'post-combine', 'stack']:
+            chain.append((key, self._tasks[key].get_kwargs()))
+        return json.dumps(chain, sort_keys=True, default=str)
+
+    def set_ledger(self, folder, resume=True, checkpoint=10):
+        """
+        keeps a ledger of completed (starttime, station pair) units and their partial stacks in folder.
+
+        Parameters
+        ----------
+        folder: str
+            directory holding the ledger and partial stacks
+        resume: bool
+            if True, units already in the ledger are skipped and their partial stacks are merged into the result.
+            if False, the run starts over
+        checkpoint: int
+            number of windows stacked in memory before a partial stack is saved and the ledger updated
+        """
+        self._ledger_folder = folder
+        self._ledger_kwargs = dict(resume=resume, checkpoint=checkpoint)
+
+    def _get_ledger(self):
+        if self._ledger_folder is None:
+            return None
+        return ProcessingLedger(self._ledger_folder, self._get_ledger_fingerprint(), **self._ledger_kwargs)
 
     def has_data(self):
         return self._tasks['data'].has_data()
@@ -295,16 +800,27 @@ class _AnxcorData:
         else:
             print('{} is Not a valid task to save from'.format(task))
 
-    def save_at_process(self, folder, process : str='whiten'):
+    def save_at_process(self, folder, process : str='whiten', format='netcdf'):
+        """
+        saves the station windows produced by process under folder.
+
+        format='netcdf' writes one netcdf file and metadata sidecar per station and window.
+        format='chunked' appends each window to one binary file per station, and records the
+        windows of every station in one consolidated index per process
+        """
         if process in self._process_order:
-             self._tasks['process'][process].set_io_task(folder, 'save')
+             self._tasks['process'][process].set_io_task(folder, 'save', format=format)
         else:
             print('{} is not a valid process to save from'.format(process))
 
 
-    def load_at_process(self, folder, process='resample'):
+    def load_at_process(self, folder, process='resample', format='netcdf'):
+        """
+        loads the station windows saved by save_at_process instead of recomputing them.
+        chunked windows are returned as read-only memory mapped arrays
+        """
         if process in self._process_order:
-            self._tasks['process'][process].set_io_task(folder, 'load')
+            self._tasks['process'][process].set_io_task(folder, 'load', format=format)
             self._disable_tasks('process')
             self._disable_process(process)
         else:
@@ -368,10 +884,13 @@ class _AnxcorData:
     def _get_task(self,key,dask_client=None):
         if key in self._tasks.keys():
             task = self._tasks[key]
-            if dask_client is not None:
-                return copy.deepcopy(task)
-            else:
+            if dask_client is None:
                 return task
+            if self._task_snapshots is None:
+                return copy.deepcopy(task)
+            if key not in self._task_snapshots:
+                self._task_snapshots[key] = copy.deepcopy(task)
+            return self._task_snapshots[key]
         else:
             raise KeyError('key {} does not exist in tasks'.format(key))
 
@@ -518,83 +1037,112 @@ class _AnxcorConverter:
         return pairs[1], pairs[0]
 
     def align_station_pairs(self,xdataset: xr.Dataset,dask_client = None):
-        xdataset = xdataset.where(xdataset!=0)
+        """
+        rotates the ZNE channels of every station pair into the ZRT frame of the pair.
+
+        azimuths of all pairs are computed at once, and each batch of pairs is rotated with one einsum.
+        Zero samples are treated as missing, and a pair without data is taken from its reversed
+        pair. Autocorrelations are not rotated. Returns a dataset with dims
+        (src, rec, time, src_chan, rec_chan) and channels z, r, t
+        """
         df = xdataset.attrs['df']
-        merged_arrays = []
+        aligned = []
         for name in xdataset.data_vars:
-            xarray = xdataset[name]
-            arguments = itertools.product(xarray.coords['rec'].values, xarray.coords['src'].values)
-            arrays = []
-            for arg in arguments:
-                if dask_client is not None:
-                    arrays.append(dask_client.submit(self._align_pair,arg,xarray,df))
-                else:
-                    arrays.append(self._align_pair(arg, xarray,df))
-
-            if dask_client is not None:
-                merged_arrays.append(dask_client.submit(xr.merge,arrays))
-            else:
-                merged_arrays.append(xr.merge(arrays))
-        if dask_client is not None:
-            new_dataset = dask_client.submit(xr.merge,merged_arrays)
-            new_dataset = new_dataset.result()
-        else:
-            new_dataset = xr.merge(merged_arrays)
+            aligned.append(self._align_array(xdataset[name], df, dask_client=dask_client))
+        new_dataset = xr.merge(aligned)
         new_dataset.attrs['df']=df
         return new_dataset
 
-    def _align_pair(self,pair_arg,xarray,df):
-        rec = pair_arg[0]
-        src = pair_arg[1]
-        time_length   = len(xarray.coords['time'])
-        xarray = xarray.transpose('src','rec','time','src_chan','rec_chan',transpose_coords=True)
-        subset = xarray.loc[dict(rec=rec,src=src)]
-        if rec==src:
-            return self._create_radial_transverse_xarray(np.reshape(subset.data,
-                                                                    (1,1,time_length,3,3))
-                                                         ,xarray,src,rec)
-
-        data  = subset.data
-        count = np.count_nonzero(~np.isnan(data))
-        if count == 0:
-            subset = xarray.loc[dict(rec=src,src=rec)]
-            rec = pair_arg[1]
-            src = pair_arg[0]
-
-       # get coordinates
-        local_frame = df.loc[(df['src']==src) & (df['rec']==rec)].iloc[0]
-        src_lat = local_frame['src_latitude']
-        src_lon = local_frame['src_longitude']
-        rec_lat = local_frame['rec_latitude']
-        rec_lon = local_frame['rec_longitude']
-        dist, az, backaz = gps2dist_azimuth(src_lat,src_lon,rec_lat,rec_lon)
-        az      = np.deg2rad(az)
-        backaz  = np.deg2rad(backaz)
-        rotation_matrix_a = np.asarray([[1,           0,          0],
-                                        [0,  np.cos(az), np.sin(az)],
-                                        [0, -np.sin(az), np.cos(az)]])
-        rotation_matrix_b = np.asarray([[1,               0,               0],
-                                        [0, -np.cos(backaz), -np.sin(backaz)],
-                                        [0,  np.sin(backaz), -np.cos(backaz)]]).T
-        subset_data   = subset.data
-        subset_data   = np.reshape(rotation_matrix_a @ subset_data @ rotation_matrix_b,
-                                   (1,1,time_length,3,3))
-
-        return self._create_radial_transverse_xarray(subset_data,xarray,src,rec)
-
-    def _create_radial_transverse_xarray(self,data, original_xarray, src, rec):
-        xarray_rotated = xr.DataArray(data,
-                                dims=['src','rec','time','src_chan','rec_chan'],
-                                coords={
-                                    'rec_chan':['z','r','t'],
-                                    'src_chan':['z','r','t'],
-                                    'src':[src],
-                                    'rec':[rec],
-                                    'time':original_xarray.coords['time'].values
-                                    },
-                                name=original_xarray.name)
-        return xarray_rotated
-
+    def _align_array(self, xarray, df, dask_client=None):
+        xarray = xarray.transpose('src','rec','time','src_chan','rec_chan')
+        data   = xarray.data
+        srcs   = list(xarray.coords['src'].values)
+        recs   = list(xarray.coords['rec'].values)
+        src_index, rec_index, rotate = self._select_pair_blocks(data, srcs, recs)
+        out_srcs = sorted(set(srcs[index] for index in src_index))
+        out_recs = sorted(set(recs[index] for index in rec_index))
+        out_src_positions = {src: position for position, src in enumerate(out_srcs)}
+        out_rec_positions = {rec: position for position, rec in enumerate(out_recs)}
+        out_src_index = np.array([out_src_positions[srcs[index]] for index in src_index], dtype=int)
+        out_rec_index = np.array([out_rec_positions[recs[index]] for index in rec_index], dtype=int)
+        rotated = np.full((len(out_srcs), len(out_recs)) + data.shape[2:], np.nan)
+
+        azimuth, back_azimuth = self._pair_azimuths(df, [srcs[index] for index in src_index[rotate]],
+                                                        [recs[index] for index in rec_index[rotate]])
+        rotation_a, rotation_b = self._rotation_matrices(azimuth, back_azimuth)
+        batches = []
+        for start in range(0, len(src_index), ALIGN_PAIR_BATCH):
+            batch = slice(start, start + ALIGN_PAIR_BATCH)
+            batch_rotate = rotate[batch]
+            first   = np.count_nonzero(rotate[:start])
+            matrices= slice(first, first + np.count_nonzero(batch_rotate))
+            args    = (data[src_index[batch], rec_index[batch]], batch_rotate,
+                       rotation_a[matrices], rotation_b[matrices])
+            if dask_client is not None:
+                batches.append((batch, dask_client.submit(_rotate_pair_blocks, *args)))
+            else:
+                rotated[out_src_index[batch], out_rec_index[batch]] = _rotate_pair_blocks(*args)
+        for batch, future in batches:
+            rotated[out_src_index[batch], out_rec_index[batch]] = future.result()
+        return xr.DataArray(rotated,
+                            dims=['src','rec','time','src_chan','rec_chan'],
+                            coords={
+                                'rec_chan':['z','r','t'],
+                                'src_chan':['z','r','t'],
+                                'src':out_srcs,
+                                'rec':out_recs,
+                                'time':xarray.coords['time'].values
+                                },
+                            name=xarray.name)
+
+    def _select_pair_blocks(self, data, srcs, recs):
+        # every (src, rec) block to rotate: autocorrelations, pairs with data, and the reversed
+        # pair of each pair without data
+        has_data = np.zeros((len(srcs), len(recs)), dtype=bool)
+        for index in range(len(srcs)):
+            block = data[index]
+            has_data[index] = np.any((block != 0) & ~np.isnan(block), axis=tuple(range(1, block.ndim)))
+        src_positions = {src: position for position, src in enumerate(srcs)}
+        rec_positions = {rec: position for position, rec in enumerate(recs)}
+        reversed_src  = np.array([src_positions.get(rec, -1) for rec in recs], dtype=int)
+        reversed_rec  = np.array([rec_positions.get(src, -1) for src in srcs], dtype=int)
+        src_grid, rec_grid = np.meshgrid(np.arange(len(srcs)), np.arange(len(recs)), indexing='ij')
+        autocorrelation = np.array(srcs, dtype=object)[:, None] == np.array(recs, dtype=object)[None, :]
+        swap = ~autocorrelation & ~has_data & (reversed_src[None, :] >= 0) & (reversed_rec[:, None] >= 0)
+        src_grid = np.where(swap, reversed_src[None, :], src_grid)
+        rec_grid = np.where(swap, reversed_rec[:, None], rec_grid)
+        blocks    = np.unique(src_grid.ravel() * len(recs) + rec_grid.ravel())
+        src_index = blocks // len(recs)
+        rec_index = blocks %  len(recs)
+        rotate    = ~autocorrelation[src_index, rec_index]
+        return src_index, rec_index, rotate
+
+    def _pair_azimuths(self, df, srcs, recs):
+        columns = ['src_latitude','src_longitude','rec_latitude','rec_longitude']
+        pairs   = df.drop_duplicates(['src','rec'])
+        index   = pd.MultiIndex.from_arrays([pairs['src'].astype(str).values, pairs['rec'].astype(str).values])
+        rows    = index.get_indexer(pd.MultiIndex.from_arrays([np.array(srcs, dtype=str), np.array(recs, dtype=str)]))
+        for src, rec in zip(np.array(srcs)[rows < 0], np.array(recs)[rows < 0]):
+            print('no coordinates found for src:{} rec:{}. the pair will not be rotated'.format(src, rec))
+        coordinates = np.full((len(srcs), 4), np.nan)
+        coordinates[rows >= 0] = pairs[columns].values[rows[rows >= 0]]
+        azimuth, back_azimuth = _vincenty_azimuths(*coordinates.T)
+        for position in np.flatnonzero(np.isnan(azimuth) & ~np.isnan(coordinates).any(axis=1)):
+            dist, azimuth[position], back_azimuth[position] = gps2dist_azimuth(*coordinates[position])
+        return azimuth, back_azimuth
+
+    def _rotation_matrices(self, azimuth, back_azimuth):
+        az      = np.deg2rad(azimuth)
+        backaz  = np.deg2rad(back_azimuth)
+        ones    = np.ones(az.shape)
+        zeros   = np.zeros(az.shape)
+        rotation_matrix_a = np.stack([np.stack([ones,           zeros,           zeros], axis=-1),
+                                      np.stack([zeros,  np.cos(az),    np.sin(az)], axis=-1),
+                                      np.stack([zeros, -np.sin(az),    np.cos(az)], axis=-1)], axis=-2)
+        rotation_matrix_b = np.stack([np.stack([ones,            zeros,            zeros], axis=-1),
+                                      np.stack([zeros, -np.cos(backaz), -np.sin(backaz)], axis=-1),
+                                      np.stack([zeros,  np.sin(backaz), -np.cos(backaz)], axis=-1)], axis=-2)
+        return rotation_matrix_a, np.swapaxes(rotation_matrix_b, -1, -2)
 
             #ok. so for each source-receiver we need:
         # | ZZ ZR ZT |       | 1    0     0     |   | ZZ  ZN  ZE |   | 1       0       0  |
@@ -608,25 +1156,125 @@ class _AnxcorConverter:
         # Aligned_S2R2  = ROT_S2R2 * Unaligned_S2R2 * ROTINV_S2R2
         # this represents an operation where 
 
-    def save_result(self,result: xr.Dataset,directory):
+    def save_result(self,result: xr.Dataset,directory, format='netcdf'):
+        """
+        saves a result and its metadata under directory.
+
+        format='netcdf' writes one netcdf file and a csv metadata table.
+        format='mmap' writes one .npy file per data variable, a json description of the
+        coordinates and a binary metadata table, so load_result can memory map the result
+        """
+        if format not in RESULT_FORMATS:
+            print('{} is not a valid result format. choose one of {}'.format(format, RESULT_FORMATS))
+            return
         result = result.copy()
         df = result.attrs['df']
         del result.attrs['df']
         utils.make_dir(directory)
-        result.to_netcdf(path='{}{}{}.nc'.format(directory,utils.sep,'result'))
-        df.to_csv('{}{}{}.csv'.format(directory,utils.sep, 'metadata'))
-
-    def load_result(self,directory):
-        df     = pd.read_csv('{}{}{}.csv'.format(directory,utils.sep, 'metadata'))
-
-        for col in list(df.columns):
-            if 'Unnamed: 0'== col:
-                df     = df.drop(columns=['Unnamed: 0'])
-                break
-        result = xr.load_dataset('{}{}{}.nc'.format(directory,utils.sep,'result'))
+        if format == MMAP_FORMAT:
+            self._save_mmap_result(result, df, directory)
+        else:
+            result.to_netcdf(path='{}{}{}.nc'.format(directory,utils.sep,'result'))
+            df.to_csv('{}{}{}.csv'.format(directory,utils.sep, 'metadata'))
+
+    def _save_mmap_result(self, result, df, directory):
+        description = {'variables': {}, 'coords': {}, 'attrs': result.attrs}
+        for number, name in enumerate(result.data_vars):
+            file = 'variable_{}.npy'.format(number)
+            np.save('{}{}{}'.format(directory, utils.sep, file), np.ascontiguousarray(result[name].data))
+            description['variables'][name] = {'file': file, 'dims': list(result[name].dims)}
+        for dim in result.dims:
+            values = result.coords[dim].values
+            if np.issubdtype(values.dtype, np.datetime64):
+                description['coords'][dim] = {'time': utils.encode_time_coordinate(values)}
+            else:
+                description['coords'][dim] = {'values': values.tolist()}
+        with open('{}{}{}'.format(directory, utils.sep, MMAP_DESCRIPTION), 'w') as file:
+            json.dump(description, file)
+        utils.write_metadata_table(df, '{}{}{}'.format(directory, utils.sep, MMAP_METADATA))
+
+    def load_result(self,directory, pairs=None, components=None):
+        """
+        loads a result saved by save_result. the format is detected from the saved files.
+
+        pairs is a list of (src, rec) tuples and components a list of (src channel, rec channel)
+        tuples. selections are orthogonal: every source in pairs is returned with every receiver in
+        pairs, and likewise for components. memory mapped results are read only for the selected
+        pairs and components. without a selection they are returned as read-only memory maps
+        """
+        if os.path.exists('{}{}{}'.format(directory, utils.sep, MMAP_DESCRIPTION)):
+            result, df = self._load_mmap_result(directory, pairs, components)
+        else:
+            df     = pd.read_csv('{}{}{}.csv'.format(directory,utils.sep, 'metadata'))
+
+            for col in list(df.columns):
+                if 'Unnamed: 0'== col:
+                    df     = df.drop(columns=['Unnamed: 0'])
+                    break
+            if pairs is None and components is None:
+                result = xr.load_dataset('{}{}{}.nc'.format(directory,utils.sep,'result'))
+            else:
+                with xr.open_dataset('{}{}{}.nc'.format(directory,utils.sep,'result')) as dataset:
+                    coords    = {dim: dataset.coords[dim].values.tolist() for dim in dataset.dims}
+                    selection = self._result_selection(coords, pairs, components)
+                    result    = dataset.isel(**selection).load()
+        if pairs is not None or components is not None:
+            df = self._select_metadata(df, result)
         result.attrs['df'] = df
         return result
 
+    def _load_mmap_result(self, directory, pairs, components):
+        with open('{}{}{}'.format(directory, utils.sep, MMAP_DESCRIPTION), 'r') as file:
+            description = json.load(file)
+        coords = {}
+        for dim, coord in description['coords'].items():
+            if 'time' in coord:
+                coords[dim] = utils.decode_time_coordinate(coord['time'])
+            else:
+                coords[dim] = coord['values']
+        selection = self._result_selection(coords, pairs, components)
+        for dim, index in selection.items():
+            coords[dim] = [coords[dim][position] for position in index]
+        data_vars = {}
+        for name, variable in description['variables'].items():
+            data = np.load('{}{}{}'.format(directory, utils.sep, variable['file']), mmap_mode='r')
+            dims = variable['dims']
+            if selection:
+                indexers = [selection[dim] if dim in selection else np.arange(data.shape[axis])
+                            for axis, dim in enumerate(dims)]
+                data = data[np.ix_(*indexers)]
+            data_vars[name] = (dims, data)
+        result = xr.Dataset(data_vars, coords=coords, attrs=description['attrs'])
+        df = utils.read_metadata_table('{}{}{}'.format(directory, utils.sep, MMAP_METADATA))
+        return result, df
+
+    def _result_selection(self, coords, pairs, components):
+        requested = {}
+        if pairs is not None:
+            requested['src'] = [pair[0] for pair in pairs]
+            requested['rec'] = [pair[1] for pair in pairs]
+        if components is not None:
+            requested['src_chan'] = [component[0] for component in components]
+            requested['rec_chan'] = [component[1] for component in components]
+        selection = {}
+        for dim, names in requested.items():
+            values = list(coords[dim])
+            index  = []
+            for name in names:
+                if name not in values:
+                    print('{} is not in the result {} coordinates'.format(name, dim))
+                elif values.index(name) not in index:
+                    index.append(values.index(name))
+            selection[dim] = np.array(index, dtype=int)
+        return selection
+
+    def _select_metadata(self, df, result):
+        keep = np.ones(len(df), dtype=bool)
+        for dim, column in [('src', 'src'), ('rec', 'rec'), ('src_chan', 'src channel'), ('rec_chan', 'rec channel')]:
+            if column in df.columns:
+                keep &= df[column].isin(list(result.coords[dim].values)).values
+        return df[keep].reset_index(drop=True)
+
 
 
 class Anxcor(_AnxcorData, _AnxcorProcessor, _AnxcorConverter, _AnxcorConfig):
@@ -1,4 +1,5 @@
 from scipy.signal import butter, sosfilt, get_window, detrend, iirfilter,zpk2sos
+import functools
 import xarray as xr
 from obspy.core import UTCDateTime
 import numpy as np
@@ -7,6 +8,8 @@ import pandas as pd
 STARTTIME_NS_PRECISION = 100.0
 DELTA_MS_PRECISION     = 100.0/1
 ZERO                   = np.datetime64(UTCDateTime(0.0).datetime)
+SOS_DESIGN_CACHE_SIZE  = 32
+TAPER_WINDOW_CACHE_SIZE= 32
 """
 filters contained in this module:
 - lowpass
@@ -45,19 +48,14 @@ def lowpass_filter(data, freqmax=0.5, sample_rate=1, order=2,zerophase=True,axis
     norm_max_freq = freqmax / fe
     # raise for some bad scenarios
     if norm_max_freq - 1.0 > -1e-6:
-        print("freqmax ({}) of bandpass is at or above Nyquist ({}). Ignoring.").format(freqmax, fe)
+        print("freqmax ({}) of bandpass is at or above Nyquist ({}). Ignoring.".format(freqmax, fe))
         return data
 
     if norm_max_freq > 1:
         print("Selected freqmax ({}) is above Nyquist. Ignoring".format(norm_max_freq))
         return data
-    z, p, k = iirfilter(order, [norm_max_freq], btype='lowpass', ftype='butter', output='zpk')
-    sos = zpk2sos(z, p, k)
-    if zerophase:
-        result = sosfilt(sos, data)
-        return np.flip(sosfilt(sos, np.flip(result, axis=axis)), axis=axis)
-    else:
-        return sosfilt(sos, data)
+    sos = _butter_sos(order, (norm_max_freq,), 'lowpass')
+    return _apply_sos(sos, data, axis=axis, zerophase=zerophase)
 
 def bandpass_in_time_domain_sos(data, freqmin=0.01, freqmax=1.0, sample_rate=0.5,
                                 order=2, axis=-1,taper=None,zerophase=True, **kwargs):
@@ -72,13 +70,8 @@ def bandpass_in_time_domain_sos(data, freqmin=0.01, freqmax=1.0, sample_rate=0.5
     if low > 1:
         print("Selected freqmin ({}) is above Nyquist. Ignoring".format(freqmin))
         return data
-    z, p, k = iirfilter(order, [low, high], btype='band',ftype='butter', output='zpk')#,fs=sample_rate)
-    sos = zpk2sos(z, p, k)
-    if zerophase:
-        result = sosfilt(sos, data)
-        return np.flip(sosfilt(sos, np.flip(result,axis=axis)),axis=axis)
-    else:
-        return sosfilt(sos, data,axis=axis)
+    sos = _butter_sos(order, (low, high), 'band')
+    return _apply_sos(sos, data, axis=axis, zerophase=zerophase)
 
 
 def bandpass_in_time_domain_filtfilt(data, freqmin=0.01, freqmax=1.0, sample_rate=0.5,
@@ -88,41 +81,70 @@ def bandpass_in_time_domain_filtfilt(data, freqmin=0.01, freqmax=1.0, sample_rat
     high = freqmax / fe
     # raise for some bad scenarios
     if high - 1.0 > -1e-6:
-        print("freqmax ({}) of bandpass is at or above Nyquist ({}). Ignoring.").format(freqmax, fe)
+        print("freqmax ({}) of bandpass is at or above Nyquist ({}). Ignoring.".format(freqmax, fe))
         return data
 
     if low > 1:
         print("Selected freqmin ({}) is above Nyquist. Ignoring".format(freqmin))
         return data
-    z, p, k = iirfilter(order, [low, high], btype='band', ftype='butter', output='zpk')
-    sos = zpk2sos(z, p, k)
+    sos = _butter_sos(order, (low, high), 'band')
+    return _apply_sos(sos, data, axis=axis, zerophase=zerophase)
+
+
+@functools.lru_cache(maxsize=SOS_DESIGN_CACHE_SIZE)
+def _butter_sos(order, corners, btype):
+    """
+    butterworth second order sections for normalized corner frequencies.
+    designs are cached, as the same filter is applied to every station of every window
+    """
+    z, p, k = iirfilter(order, list(corners), btype=btype, ftype='butter', output='zpk')
+    return zpk2sos(z, p, k)
+
+
+def _apply_sos(sos, data, axis=-1, zerophase=True):
+    """
+    applies second order sections along axis. zerophase filters forwards then backwards
+    over reversed views, matching obspy's zerophase filters without edge padding
+    """
+    result = sosfilt(sos, data, axis=axis)
     if zerophase:
-        firstpass = sosfilt(sos, data)
-        return sosfilt(sos, firstpass[::-1])[::-1]
-    else:
-        return sosfilt(sos, data)
+        result = np.flip(sosfilt(sos, np.flip(result, axis=axis), axis=axis), axis=axis)
+    return result
 
 
-def taper_func(data, taper=0.1, axis=-1, type='hanning', taper_objective='zeros', constant=0.0, **kwargs):
+def taper_func(data, taper=0.1, axis=-1, type='hanning', taper_objective='zeros', constant=0.0,
+               inplace=False, **kwargs):
     assert taper <= 1.0, 'taper is too big. Must be less than 1.0:{}'.format(taper)
     assert taper >= 0 , 'taper is too small. Must be bigger than 0.0:{}'.format(taper)
-    taper_length = int(taper*data.shape[axis]*2+1)
-    full_window    = get_window(type,taper_length,fftbins=False)
-    ones        = np.ones(data.shape[-1])
-    center      = taper_length//2
-    if taper_length%2!=0:
-        center+=1
-    ones[:center] *=full_window[:center]
-    ones[-center:]*=full_window[-center:]
-
-    result = data * ones
+    window = _taper_window(type, taper, data.shape[-1])
+    if inplace and data.flags.writeable and np.issubdtype(data.dtype, np.floating):
+        result  = data
+        result *= window
+    else:
+        result = data * window
 
     if taper_objective=='constant':
-        new_window = (1 - ones)*constant
-        result+= new_window
+        result += (1 - window)*constant
     return result
 
 
+@functools.lru_cache(maxsize=TAPER_WINDOW_CACHE_SIZE)
+def _taper_window(type, taper, npts):
+    """
+    read only taper vector of length npts, tapering both ends by the given fraction.
+    windows are cached, as every station of every window shares the same length
+    """
+    taper_length = int(taper*npts*2+1)
+    full_window  = get_window(type,taper_length,fftbins=False)
+    ones         = np.ones(npts)
+    center       = taper_length//2
+    if taper_length%2!=0:
+        center+=1
+    ones[:center] *=full_window[:center]
+    ones[-center:]*=full_window[-center:]
+    ones.setflags(write=False)
+    return ones
+
 
 def _get_new_time_array(source_xarray):
     delta       = source_xarray.attrs['delta']
@@ -147,7 +169,6 @@ def xarray_time_2_freq(xarray : xr.DataArray,minimum_size=None):
     frequencies = _get_deltaf(xarray.data.shape[-1],xarray.attrs['delta'])
     channels    = list(xarray.coords['channel'].values)
     station_ids = list(xarray.coords['station_id'].values)
-    frequencies = frequencies.tolist()
     xarray_freq = xr.DataArray(freq_domain, coords=[channels,station_ids,frequencies],
                                             dims  =['channel', 'station_id', 'frequency'])
     return xarray_freq
@@ -155,7 +176,7 @@ def xarray_time_2_freq(xarray : xr.DataArray,minimum_size=None):
 
 def xarray_freq_2_time(freq_array : xr.DataArray, array_original):
     time_data  = irfft(freq_array.data, axis=-1)[:,:,:array_original.data.shape[-1]]
-    array_new = array_original.copy()
+    array_new = array_original.copy(deep=False)
     array_new.data = time_data
     return array_new
 
@@ -168,38 +189,52 @@ def xarray_freq_2_time_xcorr(array_fourier : np.ndarray, array_original):
     return array_new
 
 def xarray_triple_by_reflection(xarray: xr.DataArray):
-    time_span = (pd.to_datetime(min(list(xarray.coords['time'].values))),
-                 pd.to_datetime(max(list(xarray.coords['time'].values))))
-    time_delta= time_span[1]-time_span[0]
-    new_start = time_span[0]-time_delta
-    new_end   = time_span[1]+time_delta
-    negative_time_series = pd.date_range(new_start,    time_span[0],periods=xarray.data.shape[-1])
-    positive_time_series = pd.date_range(time_span[1], new_end,  periods=xarray.data.shape[-1])
-
-    negative_xarray = xarray.copy()
-    negative_xarray.data = np.flip(xarray.data,axis=-1)
-    negative_xarray.coords['time']=negative_time_series
-
-    positive_xarray = xarray.copy()
-    positive_xarray.data = np.flip(xarray.data,axis=-1)
-    positive_xarray.coords['time']=positive_time_series
-
-    negative_xarray=negative_xarray.combine_first(xarray)
-    negative_xarray=negative_xarray.combine_first(positive_xarray)
-
-    return negative_xarray
+    """
+    reflects the timeseries about its first and last samples, tripling its length less the two
+    shared endpoints
+    """
+    axis       = xarray.get_axis_num('time')
+    pad_length = xarray.shape[axis] - 1
+    pad_width  = [(0, 0)] * xarray.ndim
+    pad_width[axis] = (pad_length, pad_length)
+    tripled_data    = np.pad(xarray.data, pad_width, mode='reflect')
+
+    times_ns = xarray.coords['time'].values.astype(np.int64)
+    delta_ns = times_ns[1] - times_ns[0] if len(times_ns) > 1 else 0
+    tripled_times = (times_ns[0] + (np.arange(tripled_data.shape[axis], dtype=np.int64) - pad_length) * delta_ns)
+    coords = {name: coord for name, coord in xarray.coords.items() if 'time' not in coord.dims}
+    coords['time'] = tripled_times.astype('datetime64[ns]')
+    return xr.DataArray(tripled_data, coords=coords, dims=xarray.dims, attrs=xarray.attrs)
 
 def xarray_center_third_time(larger_xarray : xr.DataArray, original_xarray : xr.DataArray):
     new_data  = original_slice_extract(larger_xarray.data, original_xarray.data)
-    orig_copy = original_xarray.copy()
+    orig_copy = original_xarray.copy(deep=False)
     orig_copy.data=new_data
     return orig_copy
 
 ################################################# pure numpy funcs #####################################################
 
+def centered_rolling_mean(data, window, axis=-1):
+    """
+    centered running mean over axis from a cumulative sum, with the edges extended by the
+    nearest full window. equivalent to xarray's rolling(center=True, min_periods=window).mean()
+    followed by ffill and bfill
+    """
+    data       = np.moveaxis(data, axis, -1)
+    cumulative = np.zeros(data.shape[:-1] + (data.shape[-1] + 1,))
+    np.cumsum(data, axis=-1, out=cumulative[..., 1:])
+    means  = (cumulative[..., window:] - cumulative[..., :-window]) / window
+    result = np.empty(data.shape, dtype=means.dtype)
+    start  = window // 2
+    stop   = start + means.shape[-1]
+    result[..., start:stop] = means
+    result[..., :start]     = means[..., :1]
+    result[..., stop:]      = means[..., -1:]
+    return np.moveaxis(result, -1, axis)
+
 def original_slice_extract(padded_data,original_data):
     pad_length    = (padded_data.shape[-1] - original_data.shape[-1])//2
-    return padded_data.take(indices=range(pad_length,pad_length+original_data.shape[-1]),axis=-1)
+    return padded_data[..., pad_length:pad_length+original_data.shape[-1]]
 
 ################################################# helper methods #######################################################
 
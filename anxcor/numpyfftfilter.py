@@ -4,15 +4,21 @@ import pandas as pd
 import xarray as xr
 from scipy.signal import fftconvolve
 from scipy.fftpack import next_fast_len
+BATCH_BYTES            = 256 * 1024 * 1024
 STARTTIME_NS_PRECISION = 100.0
 DELTA_MS_PRECISION     = 100.0/1
 ZERO                   = np.datetime64(UTCDateTime(0.0).datetime)
 
-def xarray_crosscorrelate(source_xarray, receiver_xarray, max_tau_shift=None,**kwargs):
+def xarray_crosscorrelate(source_xarray, receiver_xarray, max_tau_shift=None, spectra=None, **kwargs):
     src_channels   = list(source_xarray['channel'].values)
     rec_channels   = list(receiver_xarray['channel'].values)
     pair = [list(source_xarray.coords['station_id'].values)[0],list(receiver_xarray.coords['station_id'].values)[0]]
-    xcorr_np_mat = _cross_correlate_xarray_data_scipy_fftconvolve(source_xarray, receiver_xarray)
+    if spectra is None:
+        xcorr_np_mat = _cross_correlate_xarray_data_scipy_fftconvolve(source_xarray, receiver_xarray)
+    else:
+        xcorr_np_mat = _cross_correlate_spectra(spectra[0], spectra[1],
+                                                source_xarray.data.shape[-1],
+                                                receiver_xarray.data.shape[-1])
 
     tau_array    = _get_new_time_array(source_xarray)
 
@@ -86,6 +92,81 @@ def _cross_correlate_xarray_data_scipy_fftconvolve(source_xarray, receiver_xarra
 
 
 
+def get_correlation_fft_length(t_1, t_2):
+    """
+    fft length which allows a full linear (non-circular) correlation of two series of length t_1 and t_2
+    """
+    return next_fast_len(t_1 + t_2 - 1)
+
+
+def xarray_correlation_spectrum(xarray, fft_length):
+    """
+    returns the (channel, frequency) rfft of a single station xarray, zero padded to fft_length
+    """
+    data = xarray.data.reshape(xarray.data.shape[0], xarray.data.shape[-1])
+    return np.fft.rfft(data, n=fft_length, axis=-1)
+
+
+def _cross_correlate_spectra(src_spectrum, rec_spectrum, t_1, t_2):
+    """
+    builds every src x rec channel correlation from precomputed spectra with one broadcasted multiply
+    and a batched inverse transform. Output ordering matches _cross_correlate_xarray_data_scipy_fftconvolve
+    """
+    fft_length     = get_correlation_fft_length(t_1, t_2)
+    cross_spectrum = src_spectrum[:, None, :] * np.conj(rec_spectrum[None, :, :])
+    circular       = np.fft.irfft(cross_spectrum, n=fft_length, axis=-1)
+    negative_lags  = circular[:, :, fft_length - (t_2 - 1):]
+    positive_lags  = circular[:, :, :t_1]
+    return np.concatenate((negative_lags, positive_lags), axis=-1)
+
+
+def get_correlation_lag_indices(source_xarray, t_1, t_2, max_tau_shift=None):
+    """
+    returns the tau array of a src/rec correlation along with the positions of each tau in the
+    circular output of an fft_length inverse transform. Tau values and max_tau_shift slicing
+    match xarray_crosscorrelate
+    """
+    fft_length  = get_correlation_fft_length(t_1, t_2)
+    tau_array   = _get_new_time_array(source_xarray)
+    full_lags   = np.arange(t_1 + t_2 - 1).reshape((1, 1, 1, 1, t_1 + t_2 - 1))
+    full_lags, tau_array = _correct_for_time_misalignment_if_necessary(tau_array, full_lags)
+    full_lags   = full_lags.ravel()
+    if max_tau_shift is not None:
+        delta = pd.Timedelta(max_tau_shift * 1e9, unit='N').to_timedelta64()
+        keep  = (tau_array >= ZERO - delta) & (tau_array <= ZERO + delta)
+        full_lags = full_lags[keep]
+        tau_array = tau_array[keep]
+    circular_indices = (full_lags - (t_2 - 1)) % fft_length
+    return tau_array, circular_indices, fft_length
+
+
+def batch_cross_correlate(src_spectra, rec_spectra, src_index, rec_index, circular_indices, fft_length, out):
+    """
+    correlates every requested pair of a (station, channel, frequency) spectral block in vectorized chunks
+
+    Parameters
+    ----------
+    src_spectra, rec_spectra: np.ndarray
+        (station, channel, frequency) complex spectra
+    src_index, rec_index: np.ndarray
+        integer station index of each pair into src_spectra and rec_spectra
+    circular_indices: np.ndarray
+        positions of the output lags in the circular correlation
+    out: np.ndarray
+        preallocated (src, rec, src_chan, rec_chan, time) array written in place. src and rec
+        positions in out follow the station ordering of src_spectra and rec_spectra
+    """
+    channels   = src_spectra.shape[1] * rec_spectra.shape[1]
+    pair_bytes = channels * (src_spectra.shape[-1] * 16 + fft_length * 8)
+    chunk      = max(1, int(BATCH_BYTES // pair_bytes))
+    for start in range(0, len(src_index), chunk):
+        end            = start + chunk
+        cross_spectrum = src_spectra[src_index[start:end], :, None, :] * \
+                         np.conj(rec_spectra[rec_index[start:end], None, :, :])
+        circular       = np.fft.irfft(cross_spectrum, n=fft_length, axis=-1)
+        out[src_index[start:end], rec_index[start:end]] = circular[..., circular_indices]
+    return out
+
 
 def _check_if_inputs_make_sense(source_array,  max_tau_shift):
     time = source_array.attrs['delta'] * (source_array.data.shape[2]-1)
@@ -7,6 +7,9 @@ except Exception:
     def objsize(obj):
         return 0
 import sys
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
 from numbers import Number
 from collections import Set, Mapping, deque
 
@@ -98,6 +101,115 @@ def _how_many_fmt(directory,format='.sac'):
     saclist  = get_files_with_extensions(filelist, format)
     return len(saclist)
 
+def encode_time_coordinate(times):
+    """
+    json friendly description of a datetime64 coordinate. Evenly sampled coordinates are
+    stored as start, step and length in nanoseconds
+    """
+    times_ns = np.asarray(times).astype('datetime64[ns]').astype(np.int64)
+    steps    = np.diff(times_ns)
+    if len(times_ns) > 1 and np.all(steps == steps[0]):
+        return {'start_ns': int(times_ns[0]), 'delta_ns': int(steps[0]), 'npts': len(times_ns)}
+    return {'values_ns': times_ns.tolist()}
+
+def decode_time_coordinate(encoded):
+    if 'values_ns' in encoded:
+        times_ns = np.array(encoded['values_ns'], dtype=np.int64)
+    else:
+        times_ns = encoded['start_ns'] + np.arange(encoded['npts'], dtype=np.int64) * encoded['delta_ns']
+    return times_ns.astype('datetime64[ns]')
+
+METADATA_TEXT_COLUMNS = ['src', 'rec', 'src channel', 'rec channel', 'operations']
+METADATA_KEY_COLUMNS  = ['rec', 'src', 'src channel', 'rec channel', 'delta', 'operations',
+                         'src_latitude', 'rec_latitude', 'src_longitude', 'rec_longitude',
+                         'src_elevation', 'rec_elevation']
+
+def metadata_table(columns):
+    """
+    builds a correlation metadata table from a dict of equal length columns. station, channel and
+    operation columns are categorical, so every row stores integer codes instead of strings
+    """
+    df = pd.DataFrame(data=columns)
+    for column in METADATA_TEXT_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    if 'stacks' in df.columns:
+        df['stacks'] = df['stacks'].astype(np.int64)
+    return df
+
+def concat_metadata(tables):
+    """
+    concatenates metadata tables column by column. categorical columns are combined by unioning
+    their categories, and columns missing from a table are filled with missing values
+    """
+    tables  = [table for table in tables if table is not None]
+    columns = []
+    for table in tables:
+        columns.extend([column for column in table.columns if column not in columns])
+    data = {}
+    for column in columns:
+        parts = [table[column] if column in table.columns else None for table in tables]
+        if any(part is not None and pd.api.types.is_categorical_dtype(part) for part in parts):
+            parts = [pd.Categorical(part) if part is not None else None for part in parts]
+            categories = next(part for part in parts if part is not None).categories
+            parts = [part if part is not None else
+                     pd.Categorical.from_codes(np.full(len(table), -1), categories=categories)
+                     for part, table in zip(parts, tables)]
+            data[column] = union_categoricals(parts, sort_categories=True, ignore_order=True)
+        else:
+            data[column] = np.concatenate([part.values if part is not None else np.full(len(table), np.nan)
+                                           for part, table in zip(parts, tables)])
+    return pd.DataFrame(data, columns=columns)
+
+def stack_metadata(tables):
+    """
+    adds the stack counts of rows that describe the same pair, channels and processing. missing
+    numeric values are treated as zero
+    """
+    joined  = concat_metadata(tables)
+    key     = [column for column in METADATA_KEY_COLUMNS if column in joined.columns]
+    numeric = [column for column in key if not pd.api.types.is_categorical_dtype(joined[column])]
+    joined[numeric] = joined[numeric].fillna(0)
+    stacked = joined.groupby(key, sort=False, observed=True)['stacks'].sum().astype(np.int64).reset_index()
+    for column in key:
+        if pd.api.types.is_categorical_dtype(stacked[column]):
+            # the grouping orders categories by appearance; keep them sorted like every other table
+            stacked[column] = stacked[column].cat.set_categories(joined[column].cat.categories)
+    return stacked
+
+def write_metadata_table(df, path):
+    """
+    writes a DataFrame as a binary table of column arrays in an npz file. categorical columns are
+    stored as integer codes and their categories, other text columns as fixed width unicode with a
+    mask of missing values, so nothing needs to be pickled
+    """
+    columns = {'columns': np.array([str(column) for column in df.columns])}
+    for number, column in enumerate(df.columns):
+        series = df[column]
+        if pd.api.types.is_categorical_dtype(series):
+            columns['codes_{}'.format(number)] = series.cat.codes.values
+            series = pd.Series(series.cat.categories)
+        values = series.values
+        if values.dtype == object:
+            missing = pd.isnull(values)
+            columns['null_{}'.format(number)] = missing
+            values  = np.array(['' if absent else str(value) for value, absent in zip(values, missing)])
+        columns['column_{}'.format(number)] = values
+    np.savez(path, **columns)
+
+def read_metadata_table(path):
+    with np.load(path, allow_pickle=False) as table:
+        data = {}
+        for number, column in enumerate(table['columns']):
+            values = table['column_{}'.format(number)]
+            if 'null_{}'.format(number) in table.files:
+                values = values.astype(object)
+                values[table['null_{}'.format(number)]] = np.nan
+            if 'codes_{}'.format(number) in table.files:
+                values = pd.Categorical.from_codes(table['codes_{}'.format(number)], categories=values)
+            data[column] = values
+        return pd.DataFrame(data, columns=list(table['columns']))
+
 def get_folderpath(filepath):
 
     for i in range(len(filepath)-1,-1,-1):
@@ -6,8 +6,12 @@ import numpy as np
 import xarray as xr
 import anxcor.filters as filt_ops
 import anxcor.numpyfftfilter as npfilt_ops
-import copy
+import functools
+from fractions import Fraction
+from scipy.signal import resample_poly
+from scipy.fftpack import irfft
 import pandas as pd
+import anxcor.utils as utils
 from anxcor.abstractions import XArrayRolling, XArrayProcessor, _XArrayRead, _XArrayWrite
 
 
@@ -35,6 +39,63 @@ WHITEN_WINDOW_RATIO=0.01
 FILTER_ORDER_WHITEN=3
 WHITEN_TYPE='reduce_metric'
 
+## a window shares one time grid across stations, so only a few grids need to be cached
+TIME_COORDINATE_CACHE_SIZE = 8
+
+## polyphase resampling constants
+POLYPHASE_MAX_FACTOR = 1000
+NANOSECONDS_PER_DAY  = 86400 * 10**9
+
+@functools.lru_cache(maxsize=TIME_COORDINATE_CACHE_SIZE)
+def _time_coordinates(starttime_ns, delta_ns, npts):
+    time_array = np.datetime64(starttime_ns, 'ns') + np.arange(npts, dtype=np.int64) * np.timedelta64(delta_ns, 'ns')
+    time_array.setflags(write=False)
+    return time_array
+
+def execute_fused_chain(processors, xarray, **kwargs):
+    """
+    runs consecutive fusable XArrayProcessors over one numpy work buffer of a station window,
+    and rebuilds the DataArray and its metadata once at the end. windows which are not an evenly
+    sampled (channel, station_id, time) block run through each processor instead, as do processors
+    which cannot be fused
+    """
+    if not all(processor._can_fuse() for processor in processors):
+        fused = []
+        for processor in processors:
+            if processor._can_fuse():
+                fused.append(processor)
+                continue
+            xarray = execute_fused_chain(fused, xarray, **kwargs)
+            fused  = []
+            xarray = processor(xarray, **kwargs)
+        return execute_fused_chain(fused, xarray, **kwargs)
+    if not processors:
+        return xarray
+    if not _is_fusable_window(xarray):
+        for processor in processors:
+            xarray = processor(xarray, **kwargs)
+        return xarray
+    times_ns = xarray.coords['time'].values.astype(np.int64)
+    window   = {'delta':    xarray.attrs['delta'],
+                'start_ns': int(times_ns[0]),
+                'delta_ns': int(times_ns[1] - times_ns[0]),
+                'channels': list(xarray.coords['channel'].values)}
+    data  = xarray.data.astype(np.float64)
+    attrs = xarray.attrs.copy()
+    for processor in processors:
+        data  = processor.execute_fused(data, window)
+        attrs = processor._extend_metadata(attrs)
+    coords = {name: coord for name, coord in xarray.coords.items() if 'time' not in coord.dims}
+    coords['time'] = _time_coordinates(window['start_ns'], window['delta_ns'], data.shape[-1])
+    return xr.DataArray(data, coords=coords, dims=xarray.dims, attrs=attrs, name=xarray.name)
+
+def _is_fusable_window(xarray):
+    if not isinstance(xarray, xr.DataArray) or xarray.dims != ('channel', 'station_id', 'time') \
+            or 'delta' not in xarray.attrs or xarray.shape[-1] < 2:
+        return False
+    steps = np.diff(xarray.coords['time'].values.astype(np.int64))
+    return bool(np.all(steps == steps[0]))
+
 class XArrayConverter(XArrayProcessor):
     """
     converts an obspy stream into an xarray
@@ -89,7 +150,9 @@ class XArrayConverter(XArrayProcessor):
         return [trace.stats.channel for trace in stream ]
 
     def _create_numpy_data(self, channels, stream):
-        data = np.zeros((len(channels), 1, len(stream[0].data)))
+        shape = (len(channels), 1, len(stream[0].data))
+        # every row is written when channels are unique, so the buffer needs no zero fill
+        data  = np.empty(shape) if len(set(channels))==len(channels) else np.zeros(shape)
         for trace in stream:
             chan = channels.index(trace.stats.channel)
             data[chan, 0, :] = trace.data
@@ -115,19 +178,10 @@ class XArrayConverter(XArrayProcessor):
         return None
 
     def _get_timeseries(self, stream):
-        starttime = np.datetime64(stream[0].stats.starttime.datetime)
-        endtime   = np.datetime64(stream[0].stats.endtime.datetime)
-        delta     = stream[0].stats.delta
-        timedelta = pd.Timedelta(delta, 's').to_timedelta64()
-        time_array= np.arange(starttime, endtime, timedelta)
-        delta_num = 1
-        while len(stream[0].data)!=len(time_array):
-            if len(stream[0].data)>len(time_array):
-                time_array=np.append(time_array,endtime+delta_num*timedelta)
-                delta_num+=1
-            else:
-                time_array=time_array[:-1]
-        return time_array
+        starttime = np.datetime64(stream[0].stats.starttime.datetime, 'ns')
+        timedelta = pd.Timedelta(stream[0].stats.delta, 's').to_timedelta64()
+        return _time_coordinates(int(starttime.astype(np.int64)), int(timedelta.astype(np.int64)),
+                                 len(stream[0].data))
 
     def _get_starttime(self,stream):
         return stream[0].stats.starttime.timestamp
@@ -163,21 +217,28 @@ class XArrayBandpass(XArrayProcessor):
             delta = xarray.attrs['delta']
         else:
             delta = xarray.attrs['df']['delta'].values[0]
-        sampling_rate = 1.0 / delta
-        ufunc_kwargs = {**self._kwargs}
-
-        if self._kwargs['freqmax'] > sampling_rate / 2:
-            ufunc_kwargs['freqmax'] = sampling_rate / 2
-
 
         filtered_array = xr.apply_ufunc(filt_ops.bandpass_in_time_domain_sos,xarray,
                                         input_core_dims=[['time']],
                                         output_core_dims=[['time']],
-                                        kwargs={**ufunc_kwargs,**{
-                                                'sample_rate': sampling_rate}})
+                                        kwargs=self._filter_kwargs(delta))
 
         return filtered_array
 
+    def execute_fused(self, data, window):
+        return filt_ops.bandpass_in_time_domain_sos(data, **self._filter_kwargs(window['delta']))
+
+    def _has_fused_kernel(self):
+        return type(self) is XArrayBandpass
+
+    def _filter_kwargs(self, delta):
+        sampling_rate = 1.0 / delta
+        ufunc_kwargs = {**self._kwargs}
+
+        if self._kwargs['freqmax'] > sampling_rate / 2:
+            ufunc_kwargs['freqmax'] = sampling_rate / 2
+        return {**ufunc_kwargs, **{'sample_rate': sampling_rate}}
+
     def _add_operation_string(self):
         return 'bandpass@{}<x(t)<{}'.format(self._kwargs['freqmin'],
                                        self._kwargs['freqmax'])
@@ -243,6 +304,12 @@ class XArrayTaper(XArrayProcessor):
 
         return filtered_array
 
+    def execute_fused(self, data, window):
+        return filt_ops.taper_func(data, **{**self._kwargs, 'inplace': True})
+
+    def _has_fused_kernel(self):
+        return type(self) is XArrayTaper
+
     def _add_operation_string(self):
         return 'taper@{}%'.format(self._kwargs['taper']*100)
 
@@ -253,43 +320,132 @@ class XArrayTaper(XArrayProcessor):
 class XArrayResample(XArrayProcessor):
     """
     resamples the provided xarray to a lower frequency
+
+    engine='interpolate' linearly interpolates the anti-aliased timeseries onto the target grid.
+    engine='polyphase' keeps every n-th anti-aliased sample when the rates differ by an integer
+    factor, reproducing the 'interpolate' grid, and uses scipy's resample_poly for other
+    rational rate ratios. ratios it cannot express fall back to 'interpolate'.
     """
 
     def __init__(self, target_rate=RESAMPLE_DEFAULT,
-                 taper=TAPER_DEFAULT,order=1,**kwargs):
+                 taper=TAPER_DEFAULT,order=1,engine='interpolate',**kwargs):
         super().__init__(**kwargs)
         self._kwargs['target_rate'] = target_rate
         self._kwargs['taper']       = taper
         self._kwargs['order']       = order
+        self._kwargs['engine']      = engine
 
     def execute(self, xarray: xr.DataArray, *args, starttime=0, **kwargs):
         delta =  xarray.attrs['delta']
-        order = self._kwargs['order']
-        sampling_rate = 1.0 / delta
-        nyquist       = self._kwargs['target_rate'] / 2.0
         target_rule = str(int((1.0 /self._kwargs['target_rate']) * SECONDS_2_NANOSECONDS)) + 'N'
 
-        mean_array     = xarray.mean(dim=['time'])
-        demeaned_array = xarray - mean_array
-        detrend_array  = xr.apply_ufunc(filt_ops.detrend, demeaned_array,
-                                        input_core_dims=[['time']],
-                                        output_core_dims = [['time']],
-                                        kwargs={'type':'linear'})
-        tapered_array = xr.apply_ufunc(filt_ops.taper_func, detrend_array,
-                                       input_core_dims=[['time']],
-                                       output_core_dims=[['time']],
-                                       kwargs={**self._kwargs})
-        filtered_array = xr.apply_ufunc(filt_ops.lowpass_filter,tapered_array,
+        filtered_array = xr.apply_ufunc(self._antialias, xarray,
                                         input_core_dims=[['time']],
                                         output_core_dims=[['time']],
-                                        kwargs={'upper_frequency':    nyquist,
-                                                'sample_rate': sampling_rate,
-                                                'order': order})
+                                        kwargs={'delta': delta})
+        if self._kwargs['engine'] == 'polyphase':
+            times_ns  = filtered_array.coords['time'].values.astype(np.int64)
+            resampled = self._polyphase_resample(filtered_array.data, times_ns, delta)
+            if resampled is not None:
+                return self._resampled_array(filtered_array, *resampled)
 
         resampled_array= filtered_array.resample(time=target_rule)\
             .interpolate('linear').bfill('time').ffill('time')
         return resampled_array
 
+    def execute_fused(self, data, window):
+        times_ns  = window['start_ns'] + np.arange(data.shape[-1], dtype=np.int64) * window['delta_ns']
+        filtered  = self._antialias(data, window['delta'])
+        resampled = None
+        if self._kwargs['engine'] == 'polyphase':
+            resampled = self._polyphase_resample(filtered, times_ns, window['delta'])
+        if resampled is None:
+            resampled = self._interpolate_onto_grid(filtered, times_ns)
+        data, window['start_ns'] = resampled
+        window['delta_ns'] = self._target_ns()
+        window['delta']    = 1.0 / self._kwargs['target_rate']
+        return data
+
+    def _has_fused_kernel(self):
+        return type(self) is XArrayResample
+
+    def _antialias(self, data, delta):
+        demeaned = data - np.nanmean(data, axis=-1, keepdims=True)
+        detrended= filt_ops.detrend(demeaned, axis=-1, type='linear', overwrite_data=True)
+        tapered  = filt_ops.taper_func(detrended, **{**self._kwargs, 'inplace': True})
+        return filt_ops.lowpass_filter(tapered, upper_frequency=self._kwargs['target_rate'] / 2.0,
+                                       sample_rate=1.0 / delta, order=self._kwargs['order'])
+
+    def _target_ns(self):
+        return int((1.0 / self._kwargs['target_rate']) * SECONDS_2_NANOSECONDS)
+
+    def _polyphase_resample(self, data, times_ns, delta):
+        target_ns = self._target_ns()
+        delta_ns  = int(round(delta * SECONDS_2_NANOSECONDS))
+        ratio     = Fraction(delta_ns, target_ns)
+        if ratio.numerator == 1:
+            return self._decimate(data, times_ns, ratio.denominator, delta_ns, target_ns)
+        if max(ratio.numerator, ratio.denominator) <= POLYPHASE_MAX_FACTOR:
+            labels_ns = self._target_grid(times_ns)
+            if labels_ns[0] != times_ns[0]:
+                # resample_poly output starts at the first sample, which is off the day anchored grid
+                return None
+            data = resample_poly(data, ratio.numerator, ratio.denominator, axis=-1)
+            return data[..., :len(labels_ns)], int(labels_ns[0])
+        return None
+
+    def _decimate(self, data, times_ns, factor, delta_ns, target_ns):
+        start_ns  = int(times_ns[0])
+        # interpolation bins are anchored to the start of the day, as in pandas
+        offset_ns = (start_ns % NANOSECONDS_PER_DAY) % target_ns
+        if offset_ns == 0:
+            first_index = 0
+        elif (target_ns - offset_ns) % delta_ns == 0:
+            first_index = (target_ns - offset_ns) // delta_ns
+        else:
+            return None
+        kept_ns = times_ns[first_index::factor]
+        if not np.array_equal(np.diff(kept_ns), np.full(len(kept_ns) - 1, target_ns)):
+            return None
+
+        data = data[..., first_index::factor]
+        if first_index > 0:
+            # the bin preceding the first sample is backfilled, as in the interpolate engine
+            data     = np.concatenate((data[..., :1], data), axis=-1)
+            start_ns = int(kept_ns[0]) - target_ns
+        else:
+            data = data.copy()
+        return data, start_ns
+
+    def _target_grid(self, times_ns):
+        # target sample times of the interpolate engine, on bins anchored to the start of the day
+        target_ns = self._target_ns()
+        day_ns    = times_ns[0] - times_ns[0] % NANOSECONDS_PER_DAY
+        first_ns  = times_ns[0]  - (times_ns[0]  - day_ns) % target_ns
+        last_ns   = times_ns[-1] - (times_ns[-1] - day_ns) % target_ns
+        return np.arange(first_ns, last_ns + 1, target_ns, dtype=np.int64)
+
+    def _interpolate_onto_grid(self, data, times_ns):
+        # numpy equivalent of the pandas resample, interpolate, bfill route used by execute
+        labels_ns = self._target_grid(times_ns)
+        first_ns  = labels_ns[0]
+        samples   = (times_ns  - times_ns[0]).astype(np.float64)
+        labels    = (labels_ns - times_ns[0]).astype(np.float64)
+
+        rows   = data.reshape(-1, data.shape[-1])
+        result = np.empty((rows.shape[0], len(labels)))
+        for index, row in enumerate(rows):
+            result[index] = np.interp(labels, samples, row)
+        leading = np.searchsorted(labels, 0.0)
+        if 0 < leading < len(labels):
+            result[:, :leading] = result[:, leading:leading + 1]
+        return result.reshape(data.shape[:-1] + (len(labels),)), int(first_ns)
+
+    def _resampled_array(self, filtered_array, data, start_ns):
+        coords = {name: coord for name, coord in filtered_array.coords.items() if 'time' not in coord.dims}
+        coords['time'] = _time_coordinates(start_ns, self._target_ns(), data.shape[-1])
+        return xr.DataArray(data, coords=coords, dims=filtered_array.dims, attrs=filtered_array.attrs)
+
     def _add_metadata_key(self):
         return ('delta',1.0/self._kwargs['target_rate'])
 
@@ -305,24 +461,195 @@ class XArrayXCorrelate(XArrayProcessor):
     """
     correlates two xarrays channel-wise in the frequency domain.
 
+    engine='fftconvolve' correlates every channel pair independently.
+    engine='spectral' transforms each station window once, caches the spectrum for the
+    current window, and builds every channel pair from the cached spectra.
+    engine='batch' behaves like 'spectral' for single pairs, and lets Anxcor correlate all
+    pairs of a window in one pass through execute_window().
     """
 
     def __init__(self,max_tau_shift=MAX_TAU_DEFAULT,
-                 taper=TAPER_DEFAULT,**kwargs):
+                 taper=TAPER_DEFAULT,engine='fftconvolve',**kwargs):
         super().__init__(**kwargs)
         self._kwargs['max_tau_shift']=max_tau_shift
         self._kwargs['taper'] = taper
+        self._kwargs['engine'] = engine
+        self._spectra = {}
+        self._spectra_starttime = None
 
 
     def execute(self, source_xarray: xr.DataArray, receiver_xarray: xr.DataArray, *args, **kwargs):
         if source_xarray is not None and receiver_xarray is not None:
+            spectra = None
+            if self._kwargs['engine'] in ('spectral', 'batch'):
+                fft_length = npfilt_ops.get_correlation_fft_length(source_xarray.data.shape[-1],
+                                                                   receiver_xarray.data.shape[-1])
+                spectra = (self._get_spectrum(source_xarray, fft_length),
+                           self._get_spectrum(receiver_xarray, fft_length))
             correlation = npfilt_ops.xarray_crosscorrelate(source_xarray,
                                                            receiver_xarray,
+                                                           spectra=spectra,
                                                            **self._kwargs)
 
             return correlation
         return None
 
+    def _get_spectrum(self, xarray, fft_length):
+        starttime = xarray.attrs.get('starttime', None)
+        if starttime != self._spectra_starttime:
+            self._spectra = {}
+            self._spectra_starttime = starttime
+        data = xarray.data
+        key  = (id(data), fft_length)
+        if key in self._spectra and self._spectra[key][0] is data:
+            return self._spectra[key][1]
+        spectrum = npfilt_ops.xarray_correlation_spectrum(xarray, fft_length)
+        self._spectra[key] = (data, spectrum)
+        return spectrum
+
+    def correlate_window(self, station_windows, sources, receivers, starttime=0, dask_client=None):
+        key = self._get_operation_key(starttime=starttime, station='window')
+        return self._launch_window_task(self.execute_window, station_windows, sources, receivers,
+                                        starttime=starttime, dask_client=dask_client, key=key)
+
+    def execute_window(self, station_windows, sources, receivers, starttime=0, **kwargs):
+        """
+        correlates every requested pair of a window at once
+
+        Parameters
+        ----------
+        station_windows: dict
+            station_id -> preprocessed xarray (or None if no data was available)
+        sources, receivers: list
+            station_ids of each pair to correlate
+
+        Returns
+        -------
+        xr.Dataset
+            the same dataset produced by correlating each pair and combining the results,
+            built from one preallocated (src, rec, src_chan, rec_chan, time) array per variable
+        """
+        groups = {}
+        for source, receiver in zip(sources, receivers):
+            src_xarray = station_windows.get(source, None)
+            rec_xarray = station_windows.get(receiver, None)
+            if src_xarray is None or rec_xarray is None:
+                continue
+            key = (src_xarray.name, rec_xarray.name, src_xarray.data.shape[-1],
+                   rec_xarray.data.shape[-1], src_xarray.attrs['delta'])
+            groups.setdefault(key, []).append((source, receiver))
+        if not groups:
+            return None
+
+        datasets  = []
+        dataframes= []
+        for key, pairs in groups.items():
+            data_array, df = self._correlate_pair_group(station_windows, pairs)
+            datasets.append(data_array.to_dataset())
+            dataframes.append(df)
+        if len(datasets) == 1:
+            result = datasets[0]
+        else:
+            result = xr.merge(datasets)
+        result.attrs = {'df': utils.concat_metadata(dataframes)}
+        return result
+
+    def _correlate_pair_group(self, station_windows, pairs):
+        src_stations = sorted(set([pair[0] for pair in pairs]))
+        rec_stations = sorted(set([pair[1] for pair in pairs]))
+        src_channels = sorted(set([chan for station in src_stations
+                                   for chan in station_windows[station].coords['channel'].values]))
+        rec_channels = sorted(set([chan for station in rec_stations
+                                   for chan in station_windows[station].coords['channel'].values]))
+        first_src    = station_windows[src_stations[0]]
+        t_1          = first_src.data.shape[-1]
+        t_2          = station_windows[rec_stations[0]].data.shape[-1]
+        tau_array, circular_indices, fft_length = npfilt_ops.get_correlation_lag_indices(
+            first_src, t_1, t_2, max_tau_shift=self._kwargs['max_tau_shift'])
+
+        src_spectra, src_present = self._get_spectral_block(station_windows, src_stations, src_channels, fft_length)
+        rec_spectra, rec_present = self._get_spectral_block(station_windows, rec_stations, rec_channels, fft_length)
+
+        src_position = {station: index for index, station in enumerate(src_stations)}
+        rec_position = {station: index for index, station in enumerate(rec_stations)}
+        src_index    = np.asarray([src_position[pair[0]] for pair in pairs], dtype=np.intp)
+        rec_index    = np.asarray([rec_position[pair[1]] for pair in pairs], dtype=np.intp)
+
+        out = np.full((len(src_stations), len(rec_stations), len(src_channels), len(rec_channels), len(tau_array)),
+                      np.nan)
+        npfilt_ops.batch_cross_correlate(src_spectra, rec_spectra, src_index, rec_index,
+                                         circular_indices, fft_length, out)
+        channel_missing = ~(src_present[src_index, :, None] & rec_present[rec_index, None, :])
+        if channel_missing.any():
+            pair, src_chan, rec_chan = np.nonzero(channel_missing)
+            out[src_index[pair], rec_index[pair], src_chan, rec_chan] = np.nan
+
+        data_array = xr.DataArray(out, coords=(('src', src_stations),
+                                               ('rec', rec_stations),
+                                               ('src_chan', src_channels),
+                                               ('rec_chan', rec_channels),
+                                               ('time', tau_array)),
+                                  name=self._get_name(first_src, station_windows[rec_stations[0]]))
+        df = self._group_metadata(station_windows, pairs)
+        return data_array, df
+
+    def _get_spectral_block(self, station_windows, stations, channels, fft_length):
+        channel_position = {channel: index for index, channel in enumerate(channels)}
+        spectra = np.zeros((len(stations), len(channels), fft_length // 2 + 1), dtype=np.complex128)
+        present = np.zeros((len(stations), len(channels)), dtype=bool)
+        for station_index, station in enumerate(stations):
+            xarray   = station_windows[station]
+            spectrum = self._get_spectrum(xarray, fft_length)
+            for row, channel in enumerate(xarray.coords['channel'].values):
+                spectra[station_index, channel_position[channel]] = spectrum[row]
+                present[station_index, channel_position[channel]] = True
+        return spectra, present
+
+    def _group_metadata(self, station_windows, pairs):
+        correlation_string = 'correlated@{}<t<{}'.format(self._kwargs['max_tau_shift'],self._kwargs['max_tau_shift'])
+        columns = {}
+        rows    = 0
+        for source, receiver in pairs:
+            xarray_1 = station_windows[source]
+            xarray_2 = station_windows[receiver]
+            row = {
+                'src'       : source,
+                'rec'       : receiver,
+                'delta'     : xarray_1.attrs['delta'],
+                'stacks'    : 1,
+                'operations': xarray_1.attrs['operations'] + OPERATIONS_SEPARATION_CHARACTER + correlation_string}
+            if 'location' in xarray_1.attrs.keys() and 'location' in xarray_2.attrs.keys():
+                if len(xarray_1.attrs['location'].keys()) > 2:
+                    row['src_elevation'] = xarray_1.attrs['location']['elevation']
+                    row['rec_elevation'] = xarray_2.attrs['location']['elevation']
+                row['rec_latitude']  = xarray_2.attrs['location']['latitude']
+                row['rec_longitude'] = xarray_2.attrs['location']['longitude']
+                row['src_latitude']  = xarray_1.attrs['location']['latitude']
+                row['src_longitude'] = xarray_1.attrs['location']['longitude']
+            src_channels = list(xarray_1.coords['channel'].values)
+            rec_channels = list(xarray_2.coords['channel'].values)
+            repeats      = len(src_channels) * len(rec_channels)
+            row['src channel'] = [chan for chan in src_channels for _ in rec_channels]
+            row['rec channel'] = rec_channels * len(src_channels)
+            for column, value in row.items():
+                if column not in columns:
+                    columns[column] = [np.nan] * rows
+                if isinstance(value, list):
+                    columns[column].extend(value)
+                else:
+                    columns[column].extend([value] * repeats)
+            rows += repeats
+            for column in columns.keys():
+                if len(columns[column]) < rows:
+                    columns[column].extend([np.nan] * (rows - len(columns[column])))
+        return utils.metadata_table(columns)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_spectra'] = {}
+        state['_spectra_starttime'] = None
+        return state
+
     def get_name(self):
         return 'crosscorrelate'
 
@@ -330,30 +657,27 @@ class XArrayXCorrelate(XArrayProcessor):
     def _persist_metadata(self, xarray_1, xarray_2, **kwargs):
         if xarray_2 is None or xarray_1 is None:
             return None
-        rows=[]
-        row ={
-                'src':list(xarray_1.coords['station_id'].values)[0],
-                'rec':list(xarray_2.coords['station_id'].values)[0],
-                'delta'         : xarray_1.attrs['delta'],
-                'stacks'        : 1,
-                'operations'    : xarray_1.attrs['operations'] + OPERATIONS_SEPARATION_CHARACTER + \
-                               'correlated@{}<t<{}'.format(self._kwargs['max_tau_shift'],self._kwargs['max_tau_shift'])}
+        src_channels = list(xarray_1.coords['channel'].values)
+        rec_channels = list(xarray_2.coords['channel'].values)
+        repeats      = len(src_channels) * len(rec_channels)
+        columns ={
+                'src'           : [list(xarray_1.coords['station_id'].values)[0]] * repeats,
+                'rec'           : [list(xarray_2.coords['station_id'].values)[0]] * repeats,
+                'delta'         : [xarray_1.attrs['delta']] * repeats,
+                'stacks'        : [1] * repeats,
+                'operations'    : [xarray_1.attrs['operations'] + OPERATIONS_SEPARATION_CHARACTER + \
+                               'correlated@{}<t<{}'.format(self._kwargs['max_tau_shift'],self._kwargs['max_tau_shift'])] * repeats}
         if 'location' in xarray_1.attrs.keys() and 'location' in xarray_2.attrs.keys():
             if len(xarray_1.attrs['location'].keys()) > 2:
-                row['src_elevation'] = xarray_1.attrs['location']['elevation']
-                row['rec_elevation']=xarray_2.attrs['location']['elevation']
-            row['rec_latitude']=xarray_2.attrs['location']['latitude']
-            row['rec_longitude']=xarray_2.attrs['location']['longitude']
-            row['src_latitude']=xarray_1.attrs['location']['latitude']
-            row['src_longitude']=xarray_1.attrs['location']['longitude']
-        for src_chan in list(xarray_1.coords['channel'].values):
-            for rec_chan in list(xarray_2.coords['channel'].values):
-                row['src channel']=src_chan
-                row['rec channel']=rec_chan
-                rows.append(row)
-                row = copy.deepcopy(row)
-        df = pd.DataFrame(data=rows)
-        return {'df':df}
+                columns['src_elevation'] = [xarray_1.attrs['location']['elevation']] * repeats
+                columns['rec_elevation'] = [xarray_2.attrs['location']['elevation']] * repeats
+            columns['rec_latitude'] = [xarray_2.attrs['location']['latitude']] * repeats
+            columns['rec_longitude']= [xarray_2.attrs['location']['longitude']] * repeats
+            columns['src_latitude'] = [xarray_1.attrs['location']['latitude']] * repeats
+            columns['src_longitude']= [xarray_1.attrs['location']['longitude']] * repeats
+        columns['src channel'] = [chan for chan in src_channels for _ in rec_channels]
+        columns['rec channel'] = rec_channels * len(src_channels)
+        return {'df':utils.metadata_table(columns)}
 
     def _use_operation(self):
         return False
@@ -394,6 +718,13 @@ class XArrayRemoveMeanTrend(XArrayProcessor):
 
         return demeaned
 
+    def execute_fused(self, data, window):
+        detrended = filt_ops.detrend(data, axis=-1, type='linear', overwrite_data=True)
+        return filt_ops.detrend(detrended, axis=-1, type='constant', overwrite_data=True)
+
+    def _has_fused_kernel(self):
+        return type(self) is XArrayRemoveMeanTrend
+
     def _add_operation_string(self):
         return 'remove_Mean&Trend'
 
@@ -452,7 +783,7 @@ class XArrayTemporalNorm(XArrayRolling):
         tapered        = xr.apply_ufunc(filt_ops.taper_func, tripled_xarray,
                                        input_core_dims=[['time']],
                                        output_core_dims=[['time']],
-                                       kwargs={**self.get_kwargs()},
+                                       kwargs={**self.get_kwargs(),'inplace':True},
                                        keep_attrs=True)
         bp_data        = xr.apply_ufunc(filt_ops.bandpass_in_time_domain_sos,tapered,
                                        input_core_dims=[['time']],
@@ -472,10 +803,28 @@ class XArrayTemporalNorm(XArrayRolling):
         filtered_array = xr.apply_ufunc(filt_ops.taper_func, normed_array,
                                         input_core_dims=[['time']],
                                         output_core_dims=[['time']],
-                                        kwargs={**self._kwargs})
+                                        kwargs={**self._kwargs,'inplace':True})
 
         return filtered_array
 
+    def _pre_rolling_process_fused(self, processed, data, window):
+        pad_length = processed.shape[-1] - 1
+        pad_width  = [(0, 0)] * (processed.ndim - 1) + [(pad_length, pad_length)]
+        tripled    = np.pad(processed, pad_width, mode='reflect')
+        tapered    = filt_ops.taper_func(tripled, **{**self.get_kwargs(), 'inplace': True})
+        bp_data    = filt_ops.bandpass_in_time_domain_sos(tapered, **{**{'sample_rate': 1.0 / window['delta']},
+                                                                   **self.get_kwargs()})
+        return np.abs(bp_data)
+
+    def _post_rolling_process_fused(self, rolled, data, window):
+        return filt_ops.original_slice_extract(rolled, data)
+
+    def _has_fused_kernel(self):
+        return type(self) is XArrayTemporalNorm and self._has_rolling_mean_kernel()
+
+    def _postprocess_fused(self, normalized, data, window):
+        return filt_ops.taper_func(normalized, **{**self._kwargs, 'inplace': True})
+
     def get_name(self):
         return 'temp_norm'
 
@@ -538,15 +887,40 @@ class XArrayWhiten(XArrayRolling):
         tapered_array     = xr.apply_ufunc(filt_ops.taper_func, time_domain_array,
                                             input_core_dims=[['time']],
                                             output_core_dims=[['time']],
-                                            kwargs={**self._kwargs,'sample_rate':sample_rate}, keep_attrs=True)
+                                            kwargs={**self._kwargs,'sample_rate':sample_rate,'inplace':True},
+                                            keep_attrs=True)
 
         return tapered_array
 
     def _post_rolling_process(self,rolled_array : xr.DataArray, xarray : xr.DataArray)-> xr.DataArray:
         return rolled_array
 
-    def _get_rolling_samples(self,processed_xarray, xarray):
-        return int(self._kwargs['window'] * xarray.data.shape[-1]/2)
+    def _rolling_sample_count(self, delta, npts):
+        return int(self._kwargs['window'] * npts/2)
+
+    def _preprocess_fused(self, data, window):
+        return filt_ops._into_frequency_domain(data, axis=-1)
+
+    def _pre_rolling_process_fused(self, processed, data, window):
+        return np.abs(processed)
+
+    def _has_fused_kernel(self):
+        return type(self) is XArrayWhiten and self._has_rolling_mean_kernel()
+
+    def _postprocess_fused(self, normalized, data, window):
+        time_data = irfft(normalized, axis=-1)[..., :data.shape[-1]]
+        return filt_ops.taper_func(time_data, **{**self._kwargs, 'sample_rate': 1.0 / window['delta'],
+                                                'inplace': True})
+
+    def _apply_rolling_method(self, processed_xarray, original_xarray):
+        rolling_samples = self._get_rolling_samples(processed_xarray, original_xarray)
+        dim  = self._get_longest_dim_name(processed_xarray)
+        axis = processed_xarray.get_axis_num(dim)
+        if self._kwargs['rolling_metric'] != 'mean' or not self._kwargs['center'] \
+                or not 0 < rolling_samples <= processed_xarray.shape[axis]:
+            return super()._apply_rolling_method(processed_xarray, original_xarray)
+        smoothed = filt_ops.centered_rolling_mean(processed_xarray.data, rolling_samples, axis=axis)
+        return processed_xarray.copy(deep=False, data=smoothed)
 
     def get_name(self):
         return 'whiten'
@@ -202,6 +202,83 @@ class TestAlignOps(unittest.TestCase):
         assert np.sum(data[0,0,:,0,0]) < 1e-10, 'z component introduced rotation under 90 degree transform'
 
 
+    def test_vincenty_azimuths_match_obspy(self):
+        from anxcor.core import _vincenty_azimuths
+        from obspy.geodetics.base import gps2dist_azimuth
+        rng = np.random.RandomState(0)
+        lat_1, lat_2 = rng.uniform(-80, 80, 100), rng.uniform(-80, 80, 100)
+        lon_1, lon_2 = rng.uniform(-180, 180, 100), rng.uniform(-180, 180, 100)
+        azimuth, back_azimuth = _vincenty_azimuths(lat_1, lon_1, lat_2, lon_2)
+        for index in range(100):
+            dist, az, backaz = gps2dist_azimuth(lat_1[index], lon_1[index], lat_2[index], lon_2[index])
+            assert abs(azimuth[index] - az) < 1e-9
+            assert abs(back_azimuth[index] - backaz) < 1e-9
+
+    def test_vincenty_azimuths_antipodal_and_coincident(self):
+        import warnings
+        from anxcor.core import _vincenty_azimuths
+        from obspy.geodetics.base import gps2dist_azimuth
+        # near antipodes obspy's vincenty iteration does not converge, coincident stations have no azimuth
+        pairs = np.array([(0, 0, 0.5, 179.7), (0, 0, 0, 180), (10, 20, -10, -160.0001), (0, 0, 0, 179.5),
+                          (5, 5, 5, 5), (30, 40, 30, 40), (0, 0, 1, 2)], dtype=float)
+        azimuth, back_azimuth = _vincenty_azimuths(*pairs.T)
+        for index, pair in enumerate(pairs):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                dist, az, backaz = gps2dist_azimuth(*pair)
+            if caught:
+                # not converged: returned as nan, so the caller falls back to gps2dist_azimuth
+                assert np.isnan(azimuth[index]) and np.isnan(back_azimuth[index])
+            else:
+                assert abs(azimuth[index] - az) < 1e-9
+                assert abs(back_azimuth[index] - backaz) < 1e-9
+        assert np.isnan(azimuth[:4]).all()
+        assert azimuth[4] == 0.0 and back_azimuth[4] == 0.0
+
+        df = pd.DataFrame({'src': ['s{}'.format(index) for index in range(len(pairs))],
+                           'rec': ['r{}'.format(index) for index in range(len(pairs))],
+                           'src_latitude': pairs[:, 0], 'src_longitude': pairs[:, 1],
+                           'rec_latitude': pairs[:, 2], 'rec_longitude': pairs[:, 3]})
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            azimuth, back_azimuth = Anxcor()._pair_azimuths(df, list(df['src']), list(df['rec']))
+            expected = np.array([gps2dist_azimuth(*pair)[1:] for pair in pairs])
+        np.testing.assert_allclose(azimuth, expected[:, 0], atol=1e-9)
+        np.testing.assert_allclose(back_azimuth, expected[:, 1], atol=1e-9)
+
+    def test_batched_rotation_matches_pair_rotation(self):
+        from obspy.geodetics.base import gps2dist_azimuth
+        stations = ['a', 'b', 'c']
+        latlons  = {'a': (0, 0), 'b': (1, 2), 'c': (-2, 1)}
+        rng  = np.random.RandomState(1)
+        data = np.zeros((3, 3, 50, 3, 3))
+        rows = []
+        for src_index, src in enumerate(stations):
+            for rec_index, rec in enumerate(stations):
+                if rec_index < src_index:
+                    continue
+                data[src_index, rec_index] = rng.normal(size=(50, 3, 3))
+                rows.append({'src': src, 'rec': rec,
+                             'src_latitude': latlons[src][0], 'src_longitude': latlons[src][1],
+                             'rec_latitude': latlons[rec][0], 'rec_longitude': latlons[rec][1]})
+        dataarray = xr.DataArray(data, coords={'src': stations, 'rec': stations,
+                                               'time': np.arange(50),
+                                               'src_chan': ['Z', 'N', 'E'], 'rec_chan': ['Z', 'N', 'E']},
+                                 dims=['src', 'rec', 'time', 'src_chan', 'rec_chan'], name='test_array')
+        dataset = dataarray.to_dataset()
+        dataset.attrs['df'] = pd.DataFrame(rows)
+        aligned = Anxcor().align_station_pairs(dataset)['test_array']
+
+        dist, az, backaz = gps2dist_azimuth(0, 0, 1, 2)
+        az, backaz = np.deg2rad(az), np.deg2rad(backaz)
+        rotation_a = np.asarray([[1, 0, 0], [0, np.cos(az), np.sin(az)], [0, -np.sin(az), np.cos(az)]])
+        rotation_b = np.asarray([[1, 0, 0], [0, -np.cos(backaz), -np.sin(backaz)], [0, np.sin(backaz), -np.cos(backaz)]]).T
+        np.testing.assert_allclose(aligned.loc[dict(src='a', rec='b')].data,
+                                   rotation_a @ data[0, 1] @ rotation_b, atol=1e-12)
+        np.testing.assert_array_equal(aligned.loc[dict(src='b', rec='b')].data, data[1, 1])
+        assert np.isnan(aligned.loc[dict(src='b', rec='a')].data).all()
+        assert list(aligned.coords['src_chan'].values) == ['z', 'r', 't']
+
     def test_dask_align(self):
         from distributed import Client, LocalCluster
         cluster = LocalCluster(n_workers=1, threads_per_worker=1)
@@ -64,8 +64,44 @@ class WavebankWrapper(AnxcorDatabase):
         return unique_stations
 
 
+class BulkWavebankWrapper(WavebankWrapper):
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.bulk_calls    = 0
+        self.station_calls = 0
+
+    def get_waveforms(self, **kwargs):
+        self.station_calls += 1
+        return super().get_waveforms(**kwargs)
+
+    def get_waveforms_bulk(self, requests, **kwargs):
+        self.bulk_calls += 1
+        traces = []
+        for request in requests:
+            traces.extend(super().get_waveforms(**request).traces)
+        return Stream(traces=traces)
+
+
 class TestIntegratedIOOps(unittest.TestCase):
 
+    def test_bulk_fetch_once_per_window(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 3 * 60, 0.5)
+        anxcor.add_dataset(WavebankWrapper(source_dir), 'nodals')
+        expected = anxcor.process(times)
+
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        bank = BulkWavebankWrapper(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        result = anxcor.process(times)
+        assert bank.bulk_calls == len(times)
+        assert bank.station_calls == 0
+        for name in expected.data_vars:
+            np.testing.assert_allclose(result[name].data, expected[name].data)
+
 
     def test_filter_include(self):
         anxcor = Anxcor()
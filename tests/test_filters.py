@@ -37,6 +37,64 @@ class TestSimpleRelations(unittest.TestCase):
         assert result[-1]==0
 
 
+    def test_taper_window_is_cached(self):
+        first  = filt_ops._taper_window('hann', 0.1, 1000)
+        second = filt_ops._taper_window('hann', 0.1, 1000)
+        assert first is second
+        assert not first.flags.writeable
+
+    def test_inplace_taper_matches_copy(self):
+        data   = np.random.uniform(0, 1, (3, 1000))
+        copied = filt_ops.taper_func(data, taper=0.1)
+        result = filt_ops.taper_func(data, taper=0.1, inplace=True)
+        assert result is data
+        np.testing.assert_allclose(result, copied)
+
+    def test_taper_leaves_input_untouched(self):
+        data     = np.random.uniform(0, 1, 1000)
+        original = data.copy()
+        filt_ops.taper_func(data, taper=0.1, taper_objective='constant', constant=1.0)
+        np.testing.assert_array_equal(data, original)
+
+    def test_centered_rolling_mean_matches_xarray(self):
+        data = np.random.uniform(0, 1, (2, 3, 101))
+        for window in [1, 2, 5, 10]:
+            expected = xr.DataArray(data, dims=['channel', 'station_id', 'frequency'])\
+                .rolling(frequency=window, center=True, min_periods=window).mean()\
+                .ffill('frequency').bfill('frequency')
+            result = filt_ops.centered_rolling_mean(data, window, axis=-1)
+            np.testing.assert_allclose(result, expected.data, atol=1e-12)
+
+    def test_reflection_round_trip(self):
+        xarray  = convert(synthfactory.create_random_trace(sampling_rate=20, duration=10))
+        tripled = filt_ops.xarray_triple_by_reflection(xarray)
+        length  = xarray.data.shape[-1]
+        assert tripled.data.shape[-1] == 3 * length - 2
+        np.testing.assert_array_equal(tripled.data[..., :length], np.flip(xarray.data, axis=-1))
+        np.testing.assert_array_equal(tripled.data[..., -length:], np.flip(xarray.data, axis=-1))
+        assert tripled.coords['time'].values[length - 1] == xarray.coords['time'].values[0]
+        center  = filt_ops.xarray_center_third_time(tripled, xarray)
+        np.testing.assert_array_equal(center.data, xarray.data)
+
+    def test_filter_design_is_cached(self):
+        first  = filt_ops._butter_sos(2, (0.1, 0.4), 'band')
+        second = filt_ops._butter_sos(2, (0.1, 0.4), 'band')
+        assert first is second
+
+    def test_bandpass_matches_obspy(self):
+        from obspy.signal.filter import bandpass
+        data     = np.random.uniform(-1, 1, 1000)
+        result   = filt_ops.bandpass_in_time_domain_sos(data, freqmin=0.5, freqmax=2.0,
+                                                        sample_rate=10.0, order=2)
+        expected = bandpass(data, 0.5, 2.0, 10.0, corners=2, zerophase=True)
+        np.testing.assert_allclose(result, expected, atol=1e-12)
+
+    def test_bandpass_filters_along_axis(self):
+        data     = np.random.uniform(-1, 1, (3, 2, 500))
+        block    = filt_ops.bandpass_in_time_domain_sos(data, freqmin=0.5, freqmax=2.0, sample_rate=10.0)
+        single   = filt_ops.bandpass_in_time_domain_sos(data[1, 0], freqmin=0.5, freqmax=2.0, sample_rate=10.0)
+        np.testing.assert_allclose(block[1, 0], single, atol=1e-12)
+
 
 class TestImpulseDecays(unittest.TestCase):
 
@@ -0,0 +1,186 @@
+import unittest
+# travis execution
+try:
+    from tests.synthetic_trace_factory import create_random_trace
+except:
+    from synthetic_trace_factory import create_random_trace
+from obsplus.bank import WaveBank
+from obspy.core import Stream, Trace, UTCDateTime
+from anxcor.core import Anxcor
+from anxcor.containers import AnxcorDatabase
+from anxcor.utils import _how_many_fmt
+from anxcor.abstractions import XArrayProcessor
+from anxcor.xarray_routines import XArrayConverter, XArrayRemoveMeanTrend, XArrayResample, XArrayBandpass, \
+    XArrayTemporalNorm, XArrayWhiten, XArrayTaper, execute_fused_chain
+import numpy as np
+import shutil
+import os
+
+source_dir = 'tests/test_data/test_anxcor_database/test_waveforms_multi_station'
+target_dir = 'tests/test_data/test_anxcor_database/test_fused_output'
+
+starttime_stamp = 0
+endtime_stamp   = 5*2*60
+
+convert = XArrayConverter()
+
+
+class WavebankWrapper(AnxcorDatabase):
+
+    def __init__(self, directory):
+        super().__init__()
+        self.bank = WaveBank(directory)
+        import warnings
+        warnings.filterwarnings("ignore")
+
+    def get_waveforms(self, **kwargs):
+        stream =  self.bank.get_waveforms(**kwargs)
+        traces = []
+        for trace in stream:
+            data = trace.data[:-1]
+            header = {'delta':np.floor(trace.stats.delta*1000)/1000.0,
+                      'station': trace.stats.station,
+                      'starttime':trace.stats.starttime,
+                      'channel': trace.stats.channel,
+                      'network': trace.stats.network}
+            traces.append(Trace(data,header=header))
+        return Stream(traces=traces)
+
+    def get_stations(self):
+        df = self.bank.get_availability_df()
+
+        def create_seed(row):
+            network = row['network']
+            station = row['station']
+            return network + '.' + station
+
+        df['seed'] = df.apply(lambda row: create_seed(row), axis=1)
+        unique_stations = df['seed'].unique().tolist()
+        return unique_stations
+
+
+class XArrayScale(XArrayProcessor):
+
+    def execute(self, xarray, *args, **kwargs):
+        return xarray * 2.0
+
+    def _add_operation_string(self):
+        return 'scale@2'
+
+    def get_name(self):
+        return 'scale'
+
+
+class XArrayScaledBandpass(XArrayBandpass):
+
+    def execute(self, xarray, *args, **kwargs):
+        return super().execute(xarray, *args, **kwargs) * 2.0
+
+
+class XArrayShiftedWhiten(XArrayWhiten):
+
+    def _postprocess(self, normed_array, xarray):
+        return super()._postprocess(normed_array, xarray) + 1.0
+
+
+def create_station_window():
+    stream = Stream()
+    for channel in ['Z', 'N', 'E']:
+        stream += create_random_trace(sampling_rate=50, duration=300, channel=channel,
+                                      starttime=UTCDateTime(1000.37))
+    return convert(stream)
+
+
+def create_chain(engine='interpolate', approach='rcc'):
+    return [XArrayRemoveMeanTrend(),
+            XArrayResample(target_rate=10.0, engine=engine),
+            XArrayBandpass(freqmin=0.05, freqmax=2.0),
+            XArrayTemporalNorm(freqmin=0.02, freqmax=1.0, approach=approach, reduce_metric='max'),
+            XArrayWhiten(window=0.05, freqmin=0.02, freqmax=2.0, approach=approach),
+            XArrayTaper()]
+
+
+class TestFusedChain(unittest.TestCase):
+
+    def test_fused_chain_matches_processors(self):
+        xarray = create_station_window()
+        for engine in ['interpolate', 'polyphase']:
+            for approach in ['rcc', 'src']:
+                expected = xarray.copy()
+                for processor in create_chain(engine, approach):
+                    expected = processor(expected, starttime=0, station='test')
+                result = execute_fused_chain(create_chain(engine, approach), xarray.copy(),
+                                             starttime=0, station='test')
+                scale  = np.abs(expected.data).max()
+                np.testing.assert_allclose(result.data / scale, expected.data / scale, atol=1e-9)
+                np.testing.assert_array_equal(result.coords['time'].values, expected.coords['time'].values)
+                assert result.attrs == expected.attrs
+                assert result.name  == expected.name
+
+    def test_fused_chain_leaves_input_untouched(self):
+        xarray   = create_station_window()
+        original = xarray.data.copy()
+        execute_fused_chain(create_chain(), xarray, starttime=0, station='test')
+        np.testing.assert_array_equal(xarray.data, original)
+
+    def test_custom_processor_is_not_fused(self):
+        assert not XArrayScale()._can_fuse()
+        assert XArrayBandpass()._can_fuse()
+        assert not XArrayWhiten(rolling_metric='median')._can_fuse()
+
+    def test_subclass_with_overridden_hook_is_not_fused(self):
+        assert not XArrayScaledBandpass(freqmin=0.05, freqmax=2.0)._can_fuse()
+        assert not XArrayShiftedWhiten(window=0.05, freqmin=0.02, freqmax=2.0)._can_fuse()
+        xarray   = create_station_window()
+        chain    = [XArrayRemoveMeanTrend(), XArrayResample(target_rate=10.0),
+                    XArrayScaledBandpass(freqmin=0.05, freqmax=2.0),
+                    XArrayShiftedWhiten(window=0.05, freqmin=0.02, freqmax=2.0)]
+        expected = xarray.copy()
+        for processor in chain:
+            expected = processor(expected, starttime=0, station='test')
+        result = execute_fused_chain(chain, xarray.copy(), starttime=0, station='test')
+        np.testing.assert_allclose(result.data, expected.data, atol=1e-9)
+
+
+class TestFusedAnxcor(unittest.TestCase):
+
+    def tearDown(self):
+        if os.path.exists(target_dir):
+            shutil.rmtree(target_dir)
+
+    def create_anxcor(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        anxcor.add_dataset(WavebankWrapper(source_dir), 'nodals')
+        anxcor.add_process(XArrayRemoveMeanTrend())
+        anxcor.add_process(XArrayResample(target_rate=10.0))
+        anxcor.add_process(XArrayScale())
+        anxcor.add_process(XArrayTemporalNorm(freqmin=0.02, freqmax=1.0))
+        anxcor.add_process(XArrayWhiten(window=0.05, freqmin=0.02, freqmax=2.0))
+        return anxcor
+
+    def test_fused_processing_matches_per_process(self):
+        anxcor = self.create_anxcor()
+        times  = anxcor.get_starttimes(starttime_stamp, endtime_stamp, 0.5)
+        per_process = anxcor.process(times)
+        anxcor.set_fused_processing(True)
+        fused = anxcor.process(times)
+        for name in per_process.data_vars:
+            scale = np.abs(per_process[name].data).max()
+            np.testing.assert_allclose(fused[name].transpose(*per_process[name].dims).data / scale,
+                                       per_process[name].data / scale, atol=1e-9)
+        assert list(fused.attrs['df']['operations']) == list(per_process.attrs['df']['operations'])
+
+    def test_saved_process_keeps_per_process_path(self):
+        if not os.path.exists(target_dir):
+            os.mkdir(target_dir)
+        anxcor = self.create_anxcor()
+        anxcor.set_fused_processing(True)
+        anxcor.save_at_process(target_dir, 'temp_norm:0')
+        times  = anxcor.get_starttimes(starttime_stamp, endtime_stamp, 0.5)
+        anxcor.process(times)
+        assert 20 == _how_many_fmt(target_dir, format='.nc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -101,6 +101,27 @@ class TestIntegratedIOOps(unittest.TestCase):
         assert 6 ==len(pairs)
 
 
+    def test_dask_window_granularity(self):
+        from distributed import Client, LocalCluster
+        cluster = LocalCluster(n_workers=1, threads_per_worker=1)
+        c = Client(cluster)
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        times = anxcor.get_starttimes(starttime_stamp,endtime_stamp, 0.5)
+        bank = WavebankWrapper(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        result  = anxcor.process(times,dask_client=c,granularity='window')
+        bounded = anxcor.process(times,dask_client=c,granularity='window',max_windows_in_flight=2)
+        c.close()
+        cluster.close()
+        serial = anxcor.process(times)
+        for name in serial.data_vars:
+            np.testing.assert_allclose(result[name].transpose(*serial[name].dims).data,
+                                       serial[name].data, atol=1e-12)
+            np.testing.assert_allclose(bounded[name].transpose(*serial[name].dims).data,
+                                       serial[name].data, atol=1e-12)
+
+
     def test_dask_execution_exclude(self):
 
         from distributed import Client, LocalCluster
@@ -258,6 +279,25 @@ class TestIntegratedIOOps(unittest.TestCase):
         _clean_files_in_dir(target_dir)
         assert 48 == how_many_nc
 
+    def test_dask_writes_are_deferred(self):
+        import dask
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        bank = WavebankWrapper(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        anxcor.save_at_task(target_dir, 'xconvert')
+        converter = anxcor._get_task('xconvert')
+        channels  = anxcor._get_task('data')(starttime=starttime_stamp, station='AX.1')
+        converter(channels, starttime=starttime_stamp, station='AX.1', dask_client=True)
+        assert 0 == _how_many_fmt(target_dir, format='.nc')
+        pending = converter.pop_pending_writes()
+        dask.compute(*pending, scheduler='sync')
+        how_many_nc = _how_many_fmt(target_dir, format='.nc')
+        _clean_files_in_dir(target_dir)
+        assert 1 == len(pending)
+        assert 1 == how_many_nc
+        assert converter.pop_pending_writes() == []
+
     def test_write_tempnorm_dask(self):
         from distributed import Client, LocalCluster
         from dask.distributed import wait
@@ -341,6 +381,92 @@ class TestIntegratedIOOps(unittest.TestCase):
         _clean_files_in_dir(target_dir)
         assert 20 == how_many_nc
 
+    def test_read_resample_with_prefetch(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        times = anxcor.get_starttimes(starttime_stamp,endtime_stamp, 0.5)
+        bank = WavebankWrapper(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        anxcor.add_process(XArrayResample(target_rate=10.0))
+        anxcor.save_at_process(target_dir,'resample:0')
+        saved = anxcor.process(times)
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        anxcor.add_process(XArrayResample(target_rate=10.0))
+        bank = WavebankWrapper(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        anxcor.load_at_process(target_dir, 'resample:0')
+        loaded     = anxcor.process(times)
+        prefetched = anxcor.process(times, prefetch=1)
+        _clean_files_in_dir(target_dir)
+        assert prefetched is not None, 'prefetch skipped the windows loaded by the process'
+        for name in saved.data_vars:
+            np.testing.assert_allclose(prefetched[name].transpose(*loaded[name].dims).data,
+                                       loaded[name].data, atol=1e-12)
+
+    def test_write_resample_chunked(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        times = anxcor.get_starttimes(starttime_stamp,endtime_stamp, 0.5)
+        bank = WavebankWrapper(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        anxcor.add_process(XArrayResample(target_rate=10.0))
+        anxcor.save_at_process(target_dir, 'resample:0', format='chunked')
+        result = anxcor.process(times)
+        how_many_nc  = _how_many_fmt(target_dir, format='.nc')
+        how_many_bin = _how_many_fmt(target_dir, format='.bin')
+        with open(target_dir + os.sep + 'resample:0' + os.sep + 'index.jsonl') as index_file:
+            how_many_windows = len(index_file.readlines())
+        _clean_files_in_dir(target_dir)
+        assert 0  == how_many_nc
+        assert 3  == how_many_bin
+        assert 20 == how_many_windows
+
+    def test_read_resample_chunked(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        times = anxcor.get_starttimes(starttime_stamp,endtime_stamp, 0.5)
+        bank = WavebankWrapper(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        anxcor.add_process(XArrayResample(target_rate=10.0))
+        anxcor.save_at_process(target_dir,'resample:0', format='chunked')
+        saved = anxcor.process(times)
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        anxcor.add_process(XArrayResample(target_rate=10.0))
+        bank = WavebankWrapper(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        anxcor.load_at_process(target_dir, 'resample:0', format='chunked')
+        loaded = anxcor.process(times)
+        _clean_files_in_dir(target_dir)
+        for name in saved.data_vars:
+            np.testing.assert_allclose(loaded[name].transpose(*saved[name].dims).data, saved[name].data, atol=1e-12)
+        assert list(loaded.attrs['df']['operations']) == list(saved.attrs['df']['operations'])
+
+    def test_chunked_window_round_trip(self):
+        from anxcor.abstractions import write_chunked, read_chunked
+        from anxcor.xarray_routines import XArrayConverter
+        from obspy.core import read as obspy_read
+        folder = target_dir + os.sep + 'chunked_round_trip'
+        if not path.exists(folder):
+            os.mkdir(folder)
+        xarray = XArrayConverter()(obspy_read())
+        xarray.data = xarray.data.astype(np.float64)
+        write_chunked(xarray, folder, 'window_0', 'BW.RJOB')
+        write_chunked(xarray * 2, folder, 'window_1', 'BW.RJOB')
+        first  = read_chunked(folder, 'window_0', 'BW.RJOB')
+        second = read_chunked(folder, 'window_1', 'BW.RJOB')
+        missing= read_chunked(folder, 'window_2', 'BW.RJOB')
+        _clean_files_in_dir(target_dir)
+        assert not first.data.flags.owndata
+        assert not first.data.flags.writeable
+        np.testing.assert_array_equal(first.data, xarray.data)
+        np.testing.assert_array_equal(second.data, xarray.data * 2)
+        np.testing.assert_array_equal(first.coords['time'].values, xarray.coords['time'].values)
+        assert list(first.coords['channel'].values) == list(xarray.coords['channel'].values)
+        assert first.attrs == xarray.attrs
+        assert missing is None
+
     def test_write_correlate(self):
         anxcor = Anxcor()
         anxcor.set_window_length(120.0)
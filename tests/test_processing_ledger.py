@@ -0,0 +1,163 @@
+import unittest
+from obsplus.bank import WaveBank
+from obspy.core import Stream, Trace
+from anxcor.core import Anxcor
+from anxcor.containers import AnxcorDatabase, ProcessingLedger
+import anxcor.utils as utils
+import numpy as np
+import json
+
+source_dir = 'tests/test_data/test_anxcor_database/test_waveforms_multi_station'
+ledger_dir = 'tests/test_data/test_anxcor_database/test_ledger_output'
+
+starttime_stamp = 0+1
+
+
+class CountingWavebankWrapper(AnxcorDatabase):
+
+    def __init__(self, directory):
+        super().__init__()
+        self.bank  = WaveBank(directory)
+        self.calls = 0
+        import warnings
+        warnings.filterwarnings("ignore")
+
+    def get_waveforms(self, **kwargs):
+        self.calls += 1
+        stream =  self.bank.get_waveforms(**kwargs)
+        traces = []
+        for trace in stream:
+            data = trace.data[:-1]
+            header = {'delta':np.floor(trace.stats.delta*1000)/1000.0,
+                      'station': trace.stats.station,
+                      'starttime':trace.stats.starttime,
+                      'channel': trace.stats.channel,
+                      'network': trace.stats.network}
+            traces.append(Trace(data,header=header))
+        return Stream(traces=traces)
+
+    def get_stations(self):
+        df = self.bank.get_availability_df()
+
+        def create_seed(row):
+            network = row['network']
+            station = row['station']
+            return network + '.' + station
+
+        df['seed'] = df.apply(lambda row: create_seed(row), axis=1)
+        unique_stations = df['seed'].unique().tolist()
+        return unique_stations
+
+
+def build_anxcor(ledger=True, **kwargs):
+    anxcor = Anxcor()
+    anxcor.set_window_length(100)
+    bank = CountingWavebankWrapper(source_dir)
+    anxcor.add_dataset(bank, 'nodals')
+    if ledger:
+        anxcor.set_ledger(ledger_dir, **kwargs)
+    return anxcor, bank
+
+
+def assert_results_equal(one, two):
+    for name in two.data_vars:
+        np.testing.assert_allclose(one[name].transpose(*two[name].dims).data, two[name].data, atol=1e-12)
+    key = ['src', 'rec', 'src channel', 'rec channel']
+    df_one = one.attrs['df'].sort_values(key).reset_index(drop=True)
+    df_two = two.attrs['df'].sort_values(key).reset_index(drop=True)
+    assert list(df_one['stacks']) == list(df_two['stacks'])
+
+
+class TestProcessingLedger(unittest.TestCase):
+
+    def tearDown(self):
+        if utils.folder_exists(ledger_dir):
+            utils.delete_dirs(ledger_dir)
+
+    def test_appended_windows_match_single_run(self):
+        anxcor, bank = build_anxcor(ledger=False)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        expected = anxcor.process(times)
+
+        anxcor, bank = build_anxcor(checkpoint=1)
+        anxcor.process(times[:2])
+        anxcor, bank = build_anxcor(checkpoint=1)
+        result = anxcor.process(times)
+        assert_results_equal(result, expected)
+        assert bank.calls == 3 * (len(times) - 2), 'completed windows were reloaded'
+
+    def test_completed_ledger_loads_no_data(self):
+        anxcor, bank = build_anxcor()
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        first = anxcor.process(times)
+        anxcor, bank = build_anxcor()
+        second = anxcor.process(times)
+        # only the window missing AX.2 data has pending pairs
+        assert bank.calls == 3
+        assert_results_equal(second, first)
+
+    def test_partial_stacks_consolidated(self):
+        anxcor, bank = build_anxcor(checkpoint=1)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        anxcor.process(times)
+        with open(ledger_dir + utils.sep + ProcessingLedger.LEDGER_FILE, 'r') as p_file:
+            records = [json.loads(line) for line in p_file.read().splitlines()]
+        partial_files = utils.get_files_with_extensions(utils.get_filelist(ledger_dir), '.nc')
+        assert len(records) == 2, 'consolidation should compact the log to a header and one snapshot'
+        assert len(records[1]['partials']) == 1
+        assert len(partial_files) == 1
+        metadata_files = utils.get_files_with_extensions(utils.get_filelist(ledger_dir), '.npz') + \
+                         utils.get_files_with_extensions(utils.get_filelist(ledger_dir), '.csv')
+        assert len(metadata_files) == 1, 'metadata sidecars of consolidated partial stacks remain'
+
+    def test_no_resume_recomputes(self):
+        anxcor, bank = build_anxcor()
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        anxcor.process(times)
+        anxcor, bank = build_anxcor(resume=False)
+        anxcor.process(times)
+        assert bank.calls == 3 * len(times)
+
+    def test_changed_configuration_ignores_ledger(self):
+        anxcor, bank = build_anxcor()
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        anxcor.process(times)
+        anxcor, bank = build_anxcor()
+        anxcor.set_task_kwargs('crosscorrelate', dict(max_tau_shift=20.0))
+        anxcor.process(times)
+        assert bank.calls == 3 * len(times)
+
+    def test_checkpoints_append_pair_ranges(self):
+        pair_keys = ['src:AX.{} rec:AX.{}'.format(source, receiver) for source in range(4) for receiver in range(4)]
+        ledger = ProcessingLedger(ledger_dir, 'fingerprint')
+        ledger.commit(None, [(0.0, pair_keys), (100.0, pair_keys[:5] + pair_keys[6:])])
+        ledger.commit(None, [(200.0, pair_keys)])
+        with open(ledger_dir + utils.sep + ProcessingLedger.LEDGER_FILE, 'r') as p_file:
+            records = [json.loads(line) for line in p_file.read().splitlines()]
+        assert len(records) == 3
+        assert records[2]['pairs'] == []
+        assert records[2]['units'] == {'200.000000': [[0, 16]]}
+
+        ledger = ProcessingLedger(ledger_dir, 'fingerprint')
+        assert not ledger.pending_mask(0.0, pair_keys).any()
+        assert list(np.flatnonzero(ledger.pending_mask(100.0, pair_keys))) == [5]
+        assert ledger.pending_mask(300.0, pair_keys).all()
+        assert ledger.pending_mask(0.0, ['src:AX.9 rec:AX.9']).all()
+        ledger.commit(None, [(100.0, pair_keys[5:6])])
+        assert not ProcessingLedger(ledger_dir, 'fingerprint').pending_mask(100.0, pair_keys).any()
+
+    def test_interrupted_checkpoint_is_ignored(self):
+        pair_keys = ['src:AX.1 rec:AX.1', 'src:AX.1 rec:AX.2']
+        ledger = ProcessingLedger(ledger_dir, 'fingerprint')
+        ledger.commit(None, [(0.0, pair_keys)])
+        with open(ledger_dir + utils.sep + ProcessingLedger.LEDGER_FILE, 'a') as p_file:
+            p_file.write('{"pairs": [], "units": {"100.0')
+        ledger = ProcessingLedger(ledger_dir, 'fingerprint')
+        assert not ledger.pending_mask(0.0, pair_keys).any()
+        ledger.commit(None, [(100.0, pair_keys)])
+        ledger = ProcessingLedger(ledger_dir, 'fingerprint')
+        assert not ledger.pending_mask(100.0, pair_keys).any()
+
+
+if __name__ == '__main__':
+    unittest.main()
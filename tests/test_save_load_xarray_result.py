@@ -88,6 +88,72 @@ class TestConfig(unittest.TestCase):
         final_result = anxcor.load_result(target_dir)
         assert len(final_result.to_array().squeeze().data.shape)==5
 
+    def _process(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(120.0)
+        times = anxcor.get_starttimes(starttime_stamp, endtime_stamp, 0.5)
+        bank = WavebankWrapper(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        return anxcor, anxcor.process(times)
+
+    def test_mmap_round_trip(self):
+        anxcor, original_result = self._process()
+        anxcor.save_result(original_result, target_dir, format='mmap')
+        assert _how_many_fmt(target_dir, format='.nc') == 0
+        final_result = anxcor.load_result(target_dir)
+        for name in original_result.data_vars:
+            data = final_result[name].data
+            assert not data.flags.writeable
+            np.testing.assert_array_equal(data, original_result[name].data)
+            np.testing.assert_array_equal(final_result.coords['time'].values,
+                                          original_result.coords['time'].values)
+        original_df = original_result.attrs['df']
+        final_df    = final_result.attrs['df']
+        assert list(final_df.columns) == list(original_df.columns)
+        assert list(final_df.dtypes)  == list(original_df.dtypes)
+        assert final_df.equals(original_df)
+
+    def test_mmap_pair_selection(self):
+        anxcor, original_result = self._process()
+        anxcor.save_result(original_result, target_dir, format='mmap')
+        pairs      = [('AX.2', 'AX.3')]
+        components = [('HHZ', 'HHZ'), ('HHN', 'HHZ')]
+        final_result = anxcor.load_result(target_dir, pairs=pairs, components=components)
+        expected = original_result.sel(src=['AX.2'], rec=['AX.3'], src_chan=['HHZ', 'HHN'], rec_chan=['HHZ'])
+        for name in original_result.data_vars:
+            np.testing.assert_array_equal(final_result[name].data, expected[name].data)
+        df = final_result.attrs['df']
+        assert len(df) > 0
+        assert set(df['src']) == {'AX.2'} and set(df['rec']) == {'AX.3'}
+        assert set(df['rec channel']) == {'HHZ'}
+
+    def test_netcdf_pair_selection(self):
+        anxcor, original_result = self._process()
+        anxcor.save_result(original_result, target_dir)
+        final_result = anxcor.load_result(target_dir, pairs=[('AX.1', 'AX.2')])
+        expected = original_result.sel(src=['AX.1'], rec=['AX.2'])
+        for name in original_result.data_vars:
+            np.testing.assert_allclose(final_result[name].data, expected[name].data)
+        assert set(final_result.attrs['df']['src']) == {'AX.1'}
+
+
+class TestMetadataTable(unittest.TestCase):
+
+    def tearDown(self):
+        _clean_files_in_dir(target_dir)
+
+    def test_metadata_table_round_trip(self):
+        import pandas as pd
+        df = pd.DataFrame({'src': ['AX.1', 'AX.2', None], 'delta': [0.02, 0.02, 0.04],
+                           'src_latitude': [35, 36, 37], 'stacks': [1, 2, 3]})
+        table = target_dir + utils.sep + 'metadata.npz'
+        utils.write_metadata_table(df, table)
+        result = utils.read_metadata_table(table)
+        assert list(result.columns) == list(df.columns)
+        assert list(result.dtypes) == list(df.dtypes)
+        assert list(result['src'][:2]) == ['AX.1', 'AX.2'] and result['src'].isnull()[2]
+        np.testing.assert_array_equal(result['delta'].values, df['delta'].values)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -2,8 +2,10 @@ import unittest
 from obsplus.bank import WaveBank
 from obspy.core import Stream, Trace
 from anxcor.core import Anxcor
-from anxcor.containers import  AnxcorDatabase
+from anxcor.containers import  AnxcorDatabase, XArrayStack, XArrayCombine, WindowBudget, WindowPrefetcher
+import anxcor.utils as utils
 import numpy as np
+import xarray as xr
 
 source_dir = 'tests/test_data/test_anxcor_database/test_waveforms_multi_station'
 target_dir = 'test_data/test_anxcor_database/test_save_output'
@@ -85,6 +87,16 @@ class WavebankWrapperWLatLons(AnxcorDatabase):
         unique_stations = df['seed'].unique().tolist()
         return unique_stations
 
+class CountingCombine(XArrayCombine):
+
+    def __init__(self,**kwargs):
+        super().__init__(**kwargs)
+        self.calls = 0
+
+    def execute(self, first_data, second_data, **kwargs):
+        self.calls += 1
+        return super().execute(first_data, second_data, **kwargs)
+
 
 class TestMetadataInCombine(unittest.TestCase):
 
@@ -138,7 +150,225 @@ class TestMetadataInCombine(unittest.TestCase):
         assert len_src == 3, 'not enough sources retained'
         assert len_rec == 3, 'not enough receivers retained'
 
+    def test_batch_engine_dimension_lengths(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(100)
+        anxcor.set_task_kwargs('crosscorrelate', dict(engine='batch'))
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        bank = WavebankWrapperWLatLons(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        result = anxcor.process(times)
+        assert len(list(result.data_vars)) == 1, 'too many variables added to dataset'
+        assert len(list(result.coords['src'].values)) == 3, 'not enough sources retained'
+        assert len(list(result.coords['rec'].values)) == 3, 'not enough receivers retained'
+        assert 'src_latitude' in result.attrs['df'].columns
+
+    def test_batch_engine_keeps_custom_combine(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(100)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        bank = WavebankWrapperWLatLons(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        expected = anxcor.process(times)
+        combine  = CountingCombine()
+        anxcor.set_task('combine', combine)
+        anxcor.set_task_kwargs('crosscorrelate', dict(engine='batch'))
+        assert not anxcor._use_batch_correlation()
+        result = anxcor.process(times)
+        assert combine.calls > 0, 'custom combine task was bypassed'
+        for name in expected.data_vars:
+            np.testing.assert_allclose(result[name].transpose(*expected[name].dims).data,
+                                       expected[name].data, atol=1e-8)
+
+    def test_accumulated_stack_matches_stack_tree(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(100)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        bank = WavebankWrapperWLatLons(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        accumulated = anxcor.process(times)
+        anxcor._can_accumulate_stack = lambda dask_client: False
+        tree = anxcor.process(times)
+        for name in tree.data_vars:
+            np.testing.assert_allclose(accumulated[name].transpose(*tree[name].dims).data,
+                                       tree[name].data, atol=1e-12)
+        key = ['src', 'rec', 'src channel', 'rec channel']
+        accumulated_df = accumulated.attrs['df'].sort_values(key).reset_index(drop=True)
+        tree_df        = tree.attrs['df'].sort_values(key).reset_index(drop=True)
+        assert list(accumulated_df['stacks']) == list(tree_df['stacks'])
+        assert accumulated_df['stacks'].max() == len(times)
+
+    def test_process_pool_matches_serial(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(100)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        bank = WavebankWrapperWLatLons(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        serial = anxcor.process(times)
+        pooled = anxcor.process(times, processes=2)
+        for name in serial.data_vars:
+            np.testing.assert_allclose(pooled[name].transpose(*serial[name].dims).data,
+                                       serial[name].data, atol=1e-12)
+        key = ['src', 'rec', 'src channel', 'rec channel']
+        pooled_df = pooled.attrs['df'].sort_values(key).reset_index(drop=True)
+        serial_df = serial.attrs['df'].sort_values(key).reset_index(drop=True)
+        assert list(pooled_df['stacks']) == list(serial_df['stacks'])
+
+
+    def test_single_pass_combine_matches_reduction(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(100)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        bank = WavebankWrapperWLatLons(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        reduced = anxcor.process(times)
+        anxcor.set_single_pass_combine(True)
+        single_pass = anxcor.process(times)
+        for name in reduced.data_vars:
+            np.testing.assert_allclose(single_pass[name].transpose(*reduced[name].dims).data,
+                                       reduced[name].data, atol=1e-12)
+        key = ['src', 'rec', 'src channel', 'rec channel']
+        reduced_df     = reduced.attrs['df'].sort_values(key).reset_index(drop=True)
+        single_pass_df = single_pass.attrs['df'].sort_values(key).reset_index(drop=True)
+        assert list(single_pass_df['stacks']) == list(reduced_df['stacks'])
+
+    def test_single_pass_combine_keeps_custom_execute(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(100)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        bank = WavebankWrapperWLatLons(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        combine = CountingCombine()
+        anxcor.set_task('combine', combine)
+        anxcor.set_single_pass_combine(True)
+        assert not anxcor._use_single_pass_combine()
+        anxcor.process(times)
+        assert combine.calls > 0, 'custom combine execute was bypassed'
+        anxcor.set_task('combine', type('SinglePassCombine', (CountingCombine,),
+                                        {'combine_all': XArrayCombine.combine_all})())
+        assert anxcor._use_single_pass_combine()
+
+    def test_memory_budget_flushes_match_unbounded(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(100)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        bank = WavebankWrapperWLatLons(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        # a stack subclass keeps the held-window tree path instead of the in place accumulator
+        anxcor.set_task('stack', type('TreeStack', (XArrayStack,), {})())
+        unbounded = anxcor.process(times)
+        bounded   = anxcor.process(times, memory_budget=1)
+        for name in unbounded.data_vars:
+            np.testing.assert_allclose(bounded[name].transpose(*unbounded[name].dims).data,
+                                       unbounded[name].data, atol=1e-12)
+
+    def test_prefetch_matches_serial(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(100)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        bank = WavebankWrapperWLatLons(source_dir)
+        anxcor.add_dataset(bank, 'nodals')
+        serial     = anxcor.process(times)
+        prefetched = anxcor.process(times, prefetch=2)
+        anxcor.set_task('stack', type('TreeStack', (XArrayStack,), {})())
+        tree_prefetched = anxcor.process(times, prefetch=1)
+        for name in serial.data_vars:
+            np.testing.assert_allclose(prefetched[name].data, serial[name].data, atol=1e-12)
+            np.testing.assert_allclose(tree_prefetched[name].transpose(*serial[name].dims).data,
+                                       serial[name].data, atol=1e-12)
+
+
+class TestColumnarMetadata(unittest.TestCase):
+
+    def create_table(self, sources, stacks=1):
+        return utils.metadata_table({'src': sources, 'rec': ['AX.1'] * len(sources),
+                                     'delta': [0.02] * len(sources), 'stacks': [stacks] * len(sources),
+                                     'operations': ['xconvert'] * len(sources),
+                                     'src channel': ['HHZ'] * len(sources), 'rec channel': ['HHZ'] * len(sources)})
+
+    def test_text_columns_are_categorical(self):
+        df = self.create_table(['AX.1', 'AX.2'])
+        for column in ['src', 'rec', 'src channel', 'rec channel', 'operations']:
+            assert df[column].dtype.name == 'category'
+        assert df['stacks'].dtype == np.int64
+
+    def test_concat_unions_categories(self):
+        df = utils.concat_metadata([self.create_table(['AX.1']), self.create_table(['AX.2', 'AX.3'])])
+        assert df['src'].dtype.name == 'category'
+        assert list(df['src']) == ['AX.1', 'AX.2', 'AX.3']
+
+    def test_stack_adds_counts(self):
+        df = utils.stack_metadata([self.create_table(['AX.1', 'AX.2'], stacks=2), self.create_table(['AX.2', 'AX.3'])])
+        counts = dict(zip(df['src'], df['stacks']))
+        assert counts == {'AX.1': 2, 'AX.2': 3, 'AX.3': 1}
+        assert df['stacks'].dtype == np.int64
+
+    def test_processed_metadata_is_categorical(self):
+        anxcor = Anxcor()
+        anxcor.set_window_length(100)
+        times = anxcor.get_starttimes(starttime_stamp, starttime_stamp + 2 * 100, 0.5)
+        anxcor.add_dataset(WavebankWrapperWLatLons(source_dir), 'nodals')
+        anxcor.set_task('stack', type('TreeStack', (XArrayStack,), {})())
+        df = anxcor.process(times).attrs['df']
+        assert df['src'].dtype.name == 'category'
+        assert df['stacks'].max() == len(times)
+        assert len(df) == len(df[['src', 'rec', 'src channel', 'rec channel']].drop_duplicates())
+
+
+class TestWindowPrefetcher(unittest.TestCase):
+
+    def test_windows_returned_in_order(self):
+        windows    = [(time, ['AX.1']) for time in range(10)]
+        prefetcher = WindowPrefetcher(lambda starttime, stations: starttime * 2, windows, depth=3)
+        results    = [prefetcher.get() for _ in windows]
+        prefetcher.close()
+        assert results == [(time, time * 2) for time in range(10)]
+
+    def test_queue_is_bounded(self):
+        import time
+        loaded     = []
+        windows    = [(index, []) for index in range(10)]
+        prefetcher = WindowPrefetcher(lambda starttime, stations: loaded.append(starttime), windows, depth=2)
+        time.sleep(0.5)
+        # two windows queued plus one waiting to be put
+        assert len(loaded) <= 3
+        prefetcher.close()
+
+    def test_load_errors_are_raised(self):
+        def failing_load(starttime, stations):
+            raise ValueError('bad window')
+        prefetcher = WindowPrefetcher(failing_load, [(0, [])], depth=1)
+        with self.assertRaises(ValueError):
+            prefetcher.get()
+        prefetcher.close()
+
+
+class TestWindowBudget(unittest.TestCase):
+
+    def test_unbounded_never_flushes(self):
+        budget = WindowBudget()
+        assert not budget.is_bounded()
+        assert budget.windows_allowed() is None
+        assert not budget.must_flush(1000)
+
+    def test_window_limit(self):
+        budget = WindowBudget(max_windows_in_flight=3)
+        assert budget.windows_allowed() == 3
+        assert not budget.must_flush(2)
+        assert budget.must_flush(3)
+
+    def test_memory_budget_from_observed_window(self):
+        budget = WindowBudget(memory_budget=10*8*100)
+        assert budget.windows_allowed() == 1
+        budget.observe(xr.DataArray(np.zeros(100)))
+        assert budget.windows_allowed() == 10
+        budget.observe(xr.DataArray(np.zeros(200)))
+        assert budget.windows_allowed() == 5
 
+    def test_flush_needs_two_windows(self):
+        budget = WindowBudget(max_windows_in_flight=1)
+        assert not budget.must_flush(1)
+        assert budget.must_flush(2)
 
 
 if __name__ == '__main__':
@@ -61,3 +61,76 @@ class TestIntegratedIOOps(unittest.TestCase):
         anxcor_main.set_must_only_include_station_pairs(['AX.1','AX.2'])
         correlations = anxcor_main.get_station_combinations()
         assert len(correlations)==3
+
+    def test_station_loaded_once_per_window(self):
+        anxcorWavebank = WavebankWrapper(source_dir)
+        calls = []
+        get_waveforms = anxcorWavebank.get_waveforms
+
+        def counting_get_waveforms(**kwargs):
+            calls.append((kwargs['network'], kwargs['station'], kwargs['starttime']))
+            return get_waveforms(**kwargs)
+
+        anxcorWavebank.get_waveforms = counting_get_waveforms
+        anxcor_main = Anxcor()
+        anxcor_main.set_window_length(60.0)
+        anxcor_main.add_dataset(anxcorWavebank, 'test')
+        times = anxcor_main.get_starttimes(1, 1 + 2 * 60, 0.5)
+        anxcor_main.process(times)
+        assert len(calls) == len(set(calls))
+        assert len(calls) == len(times) * 3
+
+
+class StationListDatabase(AnxcorDatabase):
+
+    def __init__(self, stations, coordinates=None):
+        super().__init__()
+        self.stations    = stations
+        self.coordinates = coordinates
+
+    def get_stations(self):
+        return self.stations
+
+    def get_station_coordinates(self):
+        if self.coordinates is None:
+            return super().get_station_coordinates()
+        return self.coordinates
+
+
+class TestPairIndex(unittest.TestCase):
+
+    def _anxcor(self, stations, coordinates=None):
+        anxcor_main = Anxcor()
+        anxcor_main.add_dataset(StationListDatabase(stations, coordinates), 'test')
+        return anxcor_main
+
+    def test_all_pairs_match_combinations_with_replacement(self):
+        import itertools
+        stations = ['UU.{}'.format(i) for i in range(7)]
+        pairs = self._anxcor(stations).get_station_combinations()
+        expected = list(itertools.combinations_with_replacement(stations, 2))
+        assert list(zip(pairs['source'], pairs['receiver'])) == expected
+
+    def test_single_include_and_exclude(self):
+        stations = ['UU.{}'.format(i) for i in range(5)]
+        anxcor_main = self._anxcor(stations)
+        anxcor_main.set_must_include_single_stations('UU.0')
+        anxcor_main.set_must_exclude_single_stations('UU.4')
+        pairs = anxcor_main.get_station_combinations()
+        assert list(zip(pairs['source'], pairs['receiver'])) == [('UU.0', 'UU.0'), ('UU.0', 'UU.1'),
+                                                                 ('UU.0', 'UU.2'), ('UU.0', 'UU.3')]
+
+    def test_distance_range(self):
+        stations    = ['UU.0', 'UU.1', 'UU.2']
+        # roughly 111 km per degree of latitude
+        coordinates = {'UU.0': (0.0, 0.0), 'UU.1': (1.0, 0.0), 'UU.2': (3.0, 0.0)}
+        anxcor_main = self._anxcor(stations, coordinates)
+        anxcor_main.set_station_distance_range(min_distance=50.0, max_distance=250.0)
+        pairs = anxcor_main.get_station_combinations()
+        assert list(zip(pairs['source'], pairs['receiver'])) == [('UU.0', 'UU.1'), ('UU.1', 'UU.2')]
+
+    def test_distance_range_excludes_missing_coordinates(self):
+        anxcor_main = self._anxcor(['UU.0', 'UU.1'], {'UU.0': (0.0, 0.0)})
+        anxcor_main.set_station_distance_range(max_distance=1000.0)
+        pairs = anxcor_main.get_station_combinations()
+        assert list(zip(pairs['source'], pairs['receiver'])) == [('UU.0', 'UU.0')]
@@ -499,6 +499,90 @@ class TestCorrelation(unittest.TestCase):
         assert 0 == np.sum(result_1.data)
 
 
+    def test_spectral_engine_equivalent(self):
+        max_tau_shift = 8
+        correlator = XArrayXCorrelate(max_tau_shift=max_tau_shift)
+        spectral_correlator = XArrayXCorrelate(max_tau_shift=max_tau_shift, engine='spectral')
+
+        synth_trace_1, synth_trace_2 = create_example_xarrays()
+
+        correlation = correlator(synth_trace_1, synth_trace_2)
+        spectral_correlation = spectral_correlator(synth_trace_1, synth_trace_2)
+        assert correlation.shape == spectral_correlation.shape
+        np.testing.assert_array_equal(correlation.coords['time'].values, spectral_correlation.coords['time'].values)
+        np.testing.assert_allclose(correlation.data, spectral_correlation.data, atol=1e-10)
+
+    def test_spectral_engine_missing_channel(self):
+        correlator = XArrayXCorrelate(max_tau_shift=None)
+        spectral_correlator = XArrayXCorrelate(max_tau_shift=None, engine='spectral')
+
+        synth_trace_1, synth_trace_2 = create_example_xarrays_missing_channel()
+
+        correlation = correlator(synth_trace_1, synth_trace_2)
+        spectral_correlation = spectral_correlator(synth_trace_1, synth_trace_2)
+        np.testing.assert_allclose(correlation.data, spectral_correlation.data, atol=1e-10)
+
+    def test_spectral_engine_reuses_station_spectrum(self):
+        spectral_correlator = XArrayXCorrelate(max_tau_shift=5.0, engine='spectral')
+        synth_trace_1, synth_trace_2 = create_example_xarrays()
+        spectral_correlator(synth_trace_1, synth_trace_2)
+        spectral_correlator(synth_trace_1, synth_trace_1)
+        spectral_correlator(synth_trace_2, synth_trace_1)
+        assert len(spectral_correlator._spectra) == 2
+
+    def test_batch_window_equivalent(self):
+        correlator = XArrayXCorrelate(max_tau_shift=8)
+        batch_correlator = XArrayXCorrelate(max_tau_shift=8, engine='batch')
+        combiner = XArrayCombine()
+
+        synth_trace_1, synth_trace_2 = create_example_xarrays_missing_channel()
+        stations = {'v.h': synth_trace_1, 'v.k': synth_trace_2}
+        sources  = ['v.h', 'v.h', 'v.k']
+        receivers= ['v.h', 'v.k', 'v.k']
+
+        combined = None
+        for source, receiver in zip(sources, receivers):
+            combined = combiner(correlator(stations[source], stations[receiver]), combined)
+        batch = batch_correlator.execute_window(stations, sources, receivers)
+
+        name = list(combined.data_vars)[0]
+        expected = combined[name]
+        result   = batch[name].transpose(*expected.dims)
+        for coord in expected.dims:
+            np.testing.assert_array_equal(expected.coords[coord].values, result.coords[coord].values)
+        np.testing.assert_allclose(expected.data, result.data, atol=1e-10)
+        assert len(batch.attrs['df'].index) == len(combined.attrs['df'].index)
+
+    def test_single_pass_combine_equivalent(self):
+        correlator = XArrayXCorrelate(max_tau_shift=8)
+        combiner = XArrayCombine()
+
+        synth_trace_1, synth_trace_2 = create_example_xarrays_missing_channel()
+        stations = {'v.h': synth_trace_1, 'v.k': synth_trace_2}
+        correlations = [correlator(stations[source], stations[receiver])
+                        for source, receiver in [('v.h', 'v.h'), ('v.h', 'v.k'), ('v.k', 'v.k')]]
+
+        combined = None
+        for correlation in correlations:
+            combined = combiner(correlation.copy(), combined)
+        single_pass = combiner.combine_all(correlations + [None])
+
+        name = list(combined.data_vars)[0]
+        expected = combined[name]
+        result   = single_pass[name].transpose(*expected.dims)
+        for coord in expected.dims:
+            np.testing.assert_array_equal(expected.coords[coord].values, result.coords[coord].values)
+        np.testing.assert_array_equal(expected.data, result.data)
+        assert len(single_pass.attrs['df'].index) == len(combined.attrs['df'].index)
+        assert combiner.combine_all([None, None]) is None
+
+    def test_batch_window_skips_missing_station(self):
+        batch_correlator = XArrayXCorrelate(max_tau_shift=8, engine='batch')
+        synth_trace_1, synth_trace_2 = create_example_xarrays()
+        stations = {'v.h': synth_trace_1, 'v.k': None}
+        batch = batch_correlator.execute_window(stations, ['v.h', 'v.h'], ['v.h', 'v.k'])
+        assert list(batch.coords['rec'].values) == ['v.h']
+
     def test_nonetype_in_out(self):
         correlator = XArrayXCorrelate()
         result = correlator(None,None, starttime=0, station=0)
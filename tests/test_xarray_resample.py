@@ -26,6 +26,35 @@ class TestDownsample(unittest.TestCase):
 
         assert round(abs(target-source), int(np.log10(1/target_rate))) == 0,"filter introduced phase shift"
 
+    def test_polyphase_decimation_matches_interpolation(self):
+        for start in [0, 0.01, 0.03]:
+            trace        = converter(create_sinsoidal_trace(sampling_rate=100, period=0.5, duration=30,
+                                                            starttime=UTCDateTime(start)))
+            interpolated = XArrayResample(target_rate=20)(trace.copy())
+            decimated    = XArrayResample(target_rate=20, engine='polyphase')(trace.copy())
+            np.testing.assert_array_equal(decimated.coords['time'].values, interpolated.coords['time'].values)
+            np.testing.assert_allclose(decimated.data, interpolated.data, atol=1e-12)
+            assert decimated.attrs['delta'] == interpolated.attrs['delta']
+
+    def test_polyphase_rational_ratio(self):
+        target_rate = 20
+        trace       = converter(create_sinsoidal_trace(sampling_rate=50, period=2.0, duration=30))
+        interpolated= XArrayResample(target_rate=target_rate)(trace.copy())
+        resampled   = XArrayResample(target_rate=target_rate, engine='polyphase')(trace.copy())
+        assert resampled.data.shape == interpolated.data.shape
+        assert resampled.attrs['delta'] == 1.0 / target_rate
+        np.testing.assert_allclose(resampled.data[..., 50:-50], interpolated.data[..., 50:-50], atol=1e-2)
+
+    def test_polyphase_rational_ratio_off_grid_start(self):
+        target_rate = 20
+        for start in [0, 0.02, 0.013]:
+            trace       = converter(create_sinsoidal_trace(sampling_rate=50, period=2.0, duration=30,
+                                                           starttime=UTCDateTime(start)))
+            interpolated= XArrayResample(target_rate=target_rate)(trace.copy())
+            resampled   = XArrayResample(target_rate=target_rate, engine='polyphase')(trace.copy())
+            np.testing.assert_array_equal(resampled.coords['time'].values, interpolated.coords['time'].values)
+            np.testing.assert_allclose(resampled.data[..., 50:-50], interpolated.data[..., 50:-50], atol=1e-2)
+
     def test_nonetype_in_out(self):
         result = converter(None)
         assert result == None
@@ -1,6 +1,6 @@
 import unittest
 from obsplus.bank import WaveBank
-from obspy.core import Stream, Trace, read
+from obspy.core import Stream, Trace, read, UTCDateTime
 from anxcor.core import Anxcor
 from anxcor.containers import  AnxcorDatabase
 from anxcor.xarray_routines import XArrayConverter
@@ -90,6 +90,74 @@ class TestObspyUtilFunction(unittest.TestCase):
 
 
 
+class TestTimeCoordinates(unittest.TestCase):
+
+    def test_time_coordinates_span_trace(self):
+        stream = read()
+        xarray = XArrayConverter()(stream)
+        times  = xarray.coords['time'].values
+        assert len(times) == stream[0].stats.npts
+        assert times[0]  == np.datetime64(stream[0].stats.starttime.datetime, 'ns')
+        assert times[-1] == np.datetime64(stream[0].stats.endtime.datetime, 'ns')
+        assert len(np.unique(np.diff(times))) == 1
+
+    def test_time_coordinates_shared_between_stations(self):
+        stream    = read()
+        converter = XArrayConverter()
+        first  = converter._get_timeseries(Stream(traces=[stream[0]]))
+        second = converter._get_timeseries(Stream(traces=[stream[1]]))
+        assert first is second
+
+
+class FixedStreamDatabase(AnxcorDatabase):
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def get_stations(self):
+        return ['UU.1']
+
+    def get_waveforms(self, **kwargs):
+        return self.stream.copy()
+
+
+def make_loader(data, trace_start, window_length=10.0):
+    from anxcor.containers import DataLoader
+    trace  = Trace(data, header={'delta': 0.1, 'station': '1', 'network': 'UU', 'channel': 'HHZ',
+                                 'starttime': UTCDateTime(trace_start)})
+    loader = DataLoader()
+    loader.set_kwargs(dict(window_length=window_length))
+    loader.add_dataset(FixedStreamDatabase(Stream(traces=[trace])), 'nodals')
+    return loader, trace
+
+
+class TestDataLoaderAlignment(unittest.TestCase):
+
+    def test_aligned_trace_matches_interpolation(self):
+        data = np.random.uniform(-1, 1, 1000)
+        loader, trace = make_loader(data, 0.0)
+        result   = loader.execute(station='UU.1', starttime=20.0)[0]
+        expected = trace.copy()
+        expected.interpolate(10.0, starttime=20.0, npts=101, method='nearest')
+        assert result.stats.starttime == UTCDateTime(20.0)
+        np.testing.assert_allclose(result.data, expected.data)
+
+    def test_fractional_offset_is_interpolated(self):
+        data = np.random.uniform(-1, 1, 1000)
+        loader, trace = make_loader(data, 0.03)
+        result   = loader.execute(station='UU.1', starttime=20.0)[0]
+        expected = trace.copy()
+        expected.interpolate(10.0, starttime=20.0, npts=101, method='nearest')
+        np.testing.assert_allclose(result.data, expected.data)
+
+    def test_nans_only_reject_their_window(self):
+        data = np.random.uniform(-1, 1, 1000)
+        data[900] = np.nan
+        loader, trace = make_loader(data, 0.0)
+        assert len(loader.execute(station='UU.1', starttime=20.0)) == 1
+        assert len(loader.execute(station='UU.1', starttime=85.0)) == 0
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
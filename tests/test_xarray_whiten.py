@@ -72,6 +72,22 @@ class TestSpectralWhitening(unittest.TestCase):
         idx = (np.abs(array - value)).argmin()
         return idx
 
+    def test_numpy_rolling_matches_xarray_rolling(self):
+        from anxcor.abstractions import XArrayRolling
+
+        class XArrayRollingWhiten(XArrayWhiten):
+            def _apply_rolling_method(self, processed_xarray, original_xarray):
+                return XArrayRolling._apply_rolling_method(self, processed_xarray, original_xarray)
+
+        trace    = convert(create_sinsoidal_trace(sampling_rate=100, period=0.5, duration=30))
+        noise    = np.random.uniform(-1, 1, trace.data.shape)
+        trace.data = trace.data + noise
+        for approach in ['rcc', 'src']:
+            kwargs   = dict(window=0.1, freqmax=20.0, freqmin=0.001, order=2, approach=approach)
+            expected = XArrayRollingWhiten(**kwargs)(trace.copy(), starttime=0, station=0)
+            result   = XArrayWhiten(**kwargs)(trace.copy(), starttime=0, station=0)
+            np.testing.assert_allclose(result.data, expected.data, atol=1e-12)
+
     def test_nonetype_in_out(self):
         result = whiten(None,starttime=0,station=0)
         assert True